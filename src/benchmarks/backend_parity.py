@@ -0,0 +1,67 @@
+# Usage (desde src/):
+# python -m benchmarks.backend_parity --backend onnx-int8 --sample 500
+
+from inference_backends import load_embedding_model, load_reranker, BACKENDS, DEFAULT_MODELS_FOLDER
+from time import perf_counter
+import numpy
+import polars
+import argparse
+
+EMBEDDING_MODEL = 'sentence-transformers/all-mpnet-base-v2'
+RERANKER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+def timed(f, *args, **kwargs):
+    start = perf_counter()
+    result = f(*args, **kwargs)
+    return result, perf_counter() - start
+
+def ranks(x: numpy.ndarray) -> numpy.ndarray:
+    return numpy.argsort(numpy.argsort(-x, kind='stable'), kind='stable')
+
+def spearman(a: numpy.ndarray, b: numpy.ndarray) -> float:
+    return float(numpy.corrcoef(ranks(a), ranks(b))[0, 1])
+
+def embedding_parity(texts: list[str], backend: str, models_folder: str, batch_size: int):
+    reference = load_embedding_model(EMBEDDING_MODEL, 'torch', 'cpu', models_folder)
+    candidate = load_embedding_model(EMBEDDING_MODEL, backend, 'cpu', models_folder)
+
+    a, ta = timed(reference.encode, texts, batch_size=batch_size, normalize_embeddings=True)
+    b, tb = timed(candidate.encode, texts, batch_size=batch_size, normalize_embeddings=True)
+
+    drift = 1 - numpy.sum(a * b, axis=1)
+    print(f"Embeddings ({len(texts)} chunks): torch {len(texts) / ta:.1f} chunks/s, {backend} {len(texts) / tb:.1f} chunks/s")
+    print(f"  cosine drift: mean {drift.mean():.2e}, p99 {numpy.quantile(drift, .99):.2e}, max {drift.max():.2e}")
+
+def reranker_parity(questions: list[str], texts: list[str], backend: str, models_folder: str, batch_size: int, top_k: int):
+    reference = load_reranker(RERANKER_MODEL, 'torch', 'cpu', models_folder)
+    candidate = load_reranker(RERANKER_MODEL, backend, 'cpu', models_folder)
+
+    pairs = [(q, t) for q in questions for t in texts]
+    a, ta = timed(reference.predict, pairs, batch_size=batch_size)
+    b, tb = timed(candidate.predict, pairs, batch_size=batch_size)
+    a, b = a.reshape(len(questions), -1), b.reshape(len(questions), -1)
+
+    print(f"Reranker ({len(pairs)} pairs): torch {len(pairs) / ta:.1f} pairs/s, {backend} {len(pairs) / tb:.1f} pairs/s")
+    print(f"  max abs score diff: {numpy.abs(a - b).max():.3e}")
+
+    for question, x, y in zip(questions, a, b):
+        overlap = len(set(numpy.argsort(-x)[:top_k]) & set(numpy.argsort(-y)[:top_k])) / min(top_k, len(x))
+        print(f"  spearman {spearman(x, y):.4f}, top-{top_k} overlap {overlap:.1%} | {question[:60]}")
+
+def main(backend: str, sample: int, models_folder: str, batch_size: int, top_k: int, seed: int):
+    texts = (polars.read_parquet('../data/arg_embeddings.parquet', columns=['text'])
+             .sample(sample, seed=seed)['text'].to_list())
+    questions = polars.read_csv('../data/preguntas_clean_arg.csv')['pregunta'].unique(maintain_order=True).to_list()
+
+    embedding_parity(texts, backend, models_folder, batch_size)
+    reranker_parity(questions, texts, backend, models_folder, batch_size, top_k)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', type=str, default='onnx-int8', choices=BACKENDS[1:], help='Backend to compare against fp32 torch')
+    parser.add_argument('--sample', type=int, default=500, help='Number of chunks to compare')
+    parser.add_argument('--models-folder', type=str, default=DEFAULT_MODELS_FOLDER, help='Folder with the exported models')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--top-k', type=int, default=50, help='Size of the top ranking compared for the reranker')
+    parser.add_argument('--seed', type=int, default=0)
+    main(**vars(parser.parse_args()))
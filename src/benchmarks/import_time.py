@@ -0,0 +1,76 @@
+# Usage (desde src/):
+# python -m benchmarks.import_time
+# python -m benchmarks.import_time --module pdf_extraction --max-ms 100
+#
+# Mide cuánto tarda en importarse un módulo (con 'python -X importtime')
+# y falla si termina importando alguna de las dependencias pesadas,
+# que deben cargarse recién en las funciones que las usan.
+
+from time import perf_counter
+import subprocess
+import argparse
+import sys
+
+HEAVY_MODULES = [
+    'chromadb',
+    'langchain_core',
+    'langchain_community',
+    'langchain_text_splitters',
+    'sentence_transformers',
+    'torch',
+    'tqdm',
+    'polars',
+    'numpy',
+]
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """Devuelve (módulo, self [us], cumulative [us]) por cada import que hace 'module'."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def wall_time(args: list[str], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True)
+        best = min(best, perf_counter() - start)
+    return best
+
+def main(module: str, max_ms: float, top: int, repeat: int) -> int:
+    rows = import_times(module)
+    total_us = next(cumulative for name, _, cumulative in rows if name == module)
+    imported = {name for name, _, _ in rows}
+    heavy = [m for m in HEAVY_MODULES if m in imported]
+
+    print(f"import {module}: {total_us / 1000:.1f} ms")
+    print("Slowest imports:")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda x: -x[2])[:top]:
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {self_us / 1000:>8.1f} ms  {name}")
+
+    if module == 'vectorize_documents':
+        print(f"'vectorize_documents.py --help': {wall_time(['vectorize_documents.py', '--help'], repeat) * 1000:.0f} ms wall time")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: importing {module} loads {heavy}", file=sys.stderr)
+        failed = True
+    if total_us / 1000 > max_ms:
+        print(f"FAIL: importing {module} takes more than {max_ms} ms", file=sys.stderr)
+        failed = True
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', type=str, default='vectorize_documents', help='Module to import')
+    parser.add_argument('--max-ms', type=float, default=250, help='Maximum cumulative import time allowed')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to show')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of --help to time (the best one is reported)')
+    sys.exit(main(**vars(parser.parse_args())))
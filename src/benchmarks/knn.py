@@ -0,0 +1,66 @@
+# Usage (desde src/):
+# python -m benchmarks.knn --persist-folder ./persist --collection imf_publications_arg --store ../data/arg_store
+#
+# Compara la búsqueda exacta de retrieval.py contra una consulta a Chroma por pregunta
+# (lo que hace extract_knn.ipynb), con los mismos embeddings de las preguntas.
+
+from retrieval import knn, load_questions, encode_questions, DEFAULT_BLOCK_SIZE, DEFAULT_FRACTION
+from utils import EmbeddingStore
+from os.path import exists, join as join_paths
+from time import perf_counter
+import numpy
+import argparse
+
+def chroma_knn(collection, query_embeddings: numpy.ndarray, k: int) -> tuple[list[list[str]], list[list[float]], float]:
+    start = perf_counter()
+    ids, distances = [], []
+    for embedding in query_embeddings:
+        result = collection.query(query_embeddings=[embedding.tolist()], n_results=k,
+                                  include=['embeddings', 'documents', 'distances'])
+        ids.extend(result['ids'])
+        distances.extend(result['distances'])
+    return ids, distances, perf_counter() - start
+
+def main(persist_folder: str, collection: str, store: str, questions: str, fraction: float, block_size: int, device: str):
+    import chromadb
+    chroma_collection = chromadb.PersistentClient(persist_folder).get_collection(collection)
+    space = (chroma_collection.metadata or {}).get('hnsw:space', 'l2')
+
+    if not exists(join_paths(store, EmbeddingStore.INDEX_FILE)):
+        EmbeddingStore.from_chroma(chroma_collection, store)
+
+    start = perf_counter()
+    embedding_store = EmbeddingStore.open(store)
+    open_seconds = perf_counter() - start
+
+    questions = load_questions(questions)
+    query_embeddings = encode_questions(questions['pregunta'].to_list(), device)
+    k = int(round(len(embedding_store) * fraction))
+
+    chroma_ids, chroma_distances, chroma_seconds = chroma_knn(chroma_collection, query_embeddings, k)
+
+    start = perf_counter()
+    rows, distances = knn(query_embeddings, embedding_store.vectors, k, space, block_size)
+    exact_seconds = perf_counter() - start
+
+    print(f"{len(questions)} questions, {len(embedding_store)} chunks, k = {k}, space = {space}")
+    print(f"Chroma: {chroma_seconds:.2f} s ({chroma_seconds / len(questions):.2f} s/question)")
+    print(f"Exact:  {exact_seconds:.2f} s (+ {open_seconds * 1000:.0f} ms to open the store), {chroma_seconds / exact_seconds:.1f}x faster")
+
+    for qid, exact_rows, exact_distances, ids, approximate_distances in zip(questions['qid'], rows, distances, chroma_ids, chroma_distances):
+        exact_ids = [embedding_store.vector_ids[i] for i in exact_rows]
+        recall = len(set(exact_ids) & set(ids)) / k
+        exact_by_id = dict(zip(exact_ids, exact_distances))
+        diffs = [abs(exact_by_id[i] - d) for i, d in zip(ids, approximate_distances) if i in exact_by_id]
+        print(f"  {qid}: Chroma recall vs exact {recall:.2%}, max distance diff {max(diffs, default=0):.2e}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--persist-folder', type=str, default='./persist', help='Chroma persist folder')
+    parser.add_argument('--collection', type=str, default='imf_publications_arg', help='Collection to compare against')
+    parser.add_argument('--store', type=str, default='../data/arg_store', help='EmbeddingStore folder (exported from the collection if missing)')
+    parser.add_argument('--questions', type=str, default='../data/preguntas_clean_arg.csv')
+    parser.add_argument('--fraction', type=float, default=DEFAULT_FRACTION, help='Fraction of the chunks retrieved per question')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--device', type=str, default='cpu')
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,60 @@
+# Usage (desde src/):
+# python -m benchmarks.pdf_backends --docs ../docs --limit 20
+
+from pdf_extraction import PDF_BACKENDS, get_backend, page_ranges
+from vectorize_documents import DEFAULT_RCT_SPLITTER
+from glob import glob
+from os.path import join as join_paths
+from time import perf_counter
+import argparse
+
+def chunk_keys(chunks) -> list[tuple]:
+    return [(c.metadata['source'], c.metadata['page'], c.metadata['start_index'], c.page_content) for c in chunks]
+
+def benchmark_backend(name: str, files: list[str], pages_per_shard: int) -> dict:
+    backend = get_backend(name)
+
+    start = perf_counter()
+    pages = [page for file in files for page in backend.extract_pages(file)]
+    elapsed = perf_counter() - start
+
+    chunks = DEFAULT_RCT_SPLITTER.split_documents(pages)
+
+    sharded_chunks = [
+        chunk
+        for file in files
+        for start_page, stop_page in page_ranges(backend.page_count(file), pages_per_shard)
+        for chunk in DEFAULT_RCT_SPLITTER.split_documents(backend.extract_pages(file, start_page, stop_page))
+    ]
+
+    return dict(
+        backend        = name,
+        pages          = len(pages),
+        seconds        = elapsed,
+        pages_per_sec  = len(pages) / elapsed if elapsed else float('inf'),
+        chunks         = chunks,
+        sharding_ok    = chunk_keys(chunks) == chunk_keys(sharded_chunks),
+    )
+
+def main(docs: str, limit: int | None, pages_per_shard: int):
+    files = sorted(glob(join_paths(docs, '*.pdf')))[:limit]
+    backends = [name for name, backend in PDF_BACKENDS.items() if backend.available()]
+
+    print(f"{len(files)} publications, backends available: {backends}")
+
+    results = [benchmark_backend(name, files, pages_per_shard) for name in backends]
+    reference = next((r for r in results if r['backend'] == 'pypdf'), results[0])
+    reference_chunks = set(c.page_content for c in reference['chunks'])
+
+    print(f"{'backend':<10} {'pages':>7} {'seconds':>9} {'pages/s':>9} {'chunks':>8} {'same text':>10} {'sharding':>9}")
+    for r in results:
+        same = sum(c.page_content in reference_chunks for c in r['chunks']) / max(1, len(r['chunks']))
+        print(f"{r['backend']:<10} {r['pages']:>7} {r['seconds']:>9.2f} {r['pages_per_sec']:>9.1f} "
+              f"{len(r['chunks']):>8} {same:>10.1%} {'ok' if r['sharding_ok'] else 'DIFFERS':>9}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=str, default='../docs', help='Folder with the publications')
+    parser.add_argument('--limit', type=int, default=None, help='Only benchmark the first N publications')
+    parser.add_argument('--pages-per-shard', type=int, default=32, help='Page range size used to check sharded extraction')
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,60 @@
+# Usage (desde src/):
+# python -m benchmarks.reranker_processes --processes 8 --sample 5000 [--no-sort-by-length]
+#
+# Compara el reranking en CPU en un solo proceso contra un pool de procesos, y ambos contra
+# CrossEncoder.predict sin ordenar (lo que escribían los q*_relevance_scores.parquet): con
+# --no-sort-by-length los scores tienen que ser idénticos, ordenando por largo se informa la
+# diferencia máxima. Informa cuántos pares por segundo hace cada uno.
+
+from reranking import ShardedReranker, RERANKER_MODEL
+from inference_backends import BACKENDS, load_reranker
+from time import perf_counter
+import numpy
+import polars
+import argparse
+
+def timed_predict(pairs: list[tuple[str, str]], processes: int, backend: str, batch_size: int, shard_size: int, sort_by_length: bool) -> tuple[numpy.ndarray, float]:
+    with ShardedReranker(RERANKER_MODEL, backend=backend, processes=processes, shard_size=shard_size, sort_by_length=sort_by_length) as reranker:
+        # El primer shard incluye la carga del modelo en los workers; se descarta del tiempo medido
+        reranker.predict(pairs[:shard_size], batch_size=batch_size)
+        start = perf_counter()
+        scores = reranker.predict(pairs, batch_size=batch_size, show_progress_bar=True)
+        return scores, perf_counter() - start
+
+def reference_predict(pairs: list[tuple[str, str]], backend: str, batch_size: int) -> tuple[numpy.ndarray, float]:
+    model = load_reranker(RERANKER_MODEL, backend=backend, device='cpu')
+    start = perf_counter()
+    scores = numpy.asarray(model.predict(pairs, batch_size=batch_size, show_progress_bar=True), dtype=numpy.float32)
+    return scores, perf_counter() - start
+
+def compare(name: str, scores: numpy.ndarray, reference: numpy.ndarray):
+    print(f"{name}: identical {numpy.array_equal(scores, reference)} (max abs diff {numpy.abs(scores - reference).max():.3e})")
+
+def main(processes: int, backend: str, sample: int, batch_size: int, shard_size: int, no_sort_by_length: bool, seed: int):
+    sort_by_length = not no_sort_by_length
+    texts = (polars.read_parquet('../data/arg_embeddings.parquet', columns=['text'])
+             .sample(sample, seed=seed)['text'].to_list())
+    question = polars.read_csv('../data/preguntas_clean_arg.csv')['pregunta'][0]
+    pairs = [(question, text) for text in texts]
+
+    reference, reference_seconds = reference_predict(pairs, backend, batch_size)
+    single, single_seconds = timed_predict(pairs, 1, backend, batch_size, shard_size, sort_by_length)
+    multi, multi_seconds = timed_predict(pairs, processes, backend, batch_size, shard_size, sort_by_length)
+
+    print(f"CrossEncoder.predict: {len(pairs) / reference_seconds:.1f} pairs/s")
+    print(f"1 process:   {len(pairs) / single_seconds:.1f} pairs/s ({reference_seconds / single_seconds:.1f}x)")
+    print(f"{processes} processes: {len(pairs) / multi_seconds:.1f} pairs/s ({reference_seconds / multi_seconds:.1f}x)")
+    compare('1 process vs CrossEncoder.predict', single, reference)
+    compare(f'{processes} processes vs CrossEncoder.predict', multi, reference)
+    compare(f'1 process vs {processes} processes', single, multi)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--backend', type=str, default='torch', choices=BACKENDS)
+    parser.add_argument('--sample', type=int, default=5000, help='Number of (question, chunk) pairs to score')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--shard-size', type=int, default=1024, help='Pairs sent to a worker at a time (rounded down to a multiple of --batch-size)')
+    parser.add_argument('--no-sort-by-length', action='store_true', help="Score each shard in its original order (identical to CrossEncoder.predict, slower)")
+    parser.add_argument('--seed', type=int, default=0)
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,115 @@
+# Usage:
+# python context_selection.py --max-tokens 20000 -o ../data/relevant_chunks
+#
+# Selección del contexto de cada (pregunta, presidente): los chunks de mayor score normalizado
+# de ese presidente cuya suma de tokens no supera el presupuesto. Todas las combinaciones se
+# resuelven en una sola consulta lazy de polars y se escriben en un dataset particionado
+# (estilo hive) por qid y presidente:
+#   relevant_chunks/qid=q0/presidente=eduhalde_0/00000000.parquet
+
+from glob import glob
+import polars
+import argparse
+import json
+import os
+import re
+import shutil
+
+DEFAULT_MAX_TOKENS = 20_000
+DEFAULT_OUTPUT = '../data/relevant_chunks'
+PARTITIONS = ['qid', 'presidente']
+
+def file_name(path: polars.Expr) -> polars.Expr:
+    """Nombre del archivo de una ruta, con separadores de Windows o de Unix."""
+    return path.str.replace_all('\\', '/', literal=True).str.split('/').list.last()
+
+def presidencies_frame(path: str = '../data/docs_por_presidencia.json') -> polars.DataFrame:
+    """(file, presidente) de docs_por_presidencia.json, con el nombre de cada archivo."""
+    with open(path, encoding='utf-8') as f:
+        docs_by_president = json.load(f)
+
+    return polars.DataFrame(
+        [dict(file=doc, presidente=president) for president, docs in docs_by_president.items() for doc in docs]
+    ).select(file_name(polars.col('file')).alias('file'), 'presidente')
+
+def within_budget(max_tokens: int, by: str | list[str]) -> tuple[polars.Expr, polars.Expr]:
+    """
+    (cumsum, filtro) del corte por presupuesto: la suma acumulada de 'token_count' dentro de
+    cada grupo, en el orden del frame (que tiene que estar ordenado por score descendente).
+    """
+    cumsum = polars.col('token_count').cum_sum().over(by).alias('cumsum')
+    return cumsum, polars.col('cumsum') <= max_tokens
+
+def scan_scores(pattern: str = '../data/q*_normalized_score.parquet') -> polars.LazyFrame:
+    """Todos los '{qid}_normalized_score.parquet' en un solo LazyFrame, con la columna 'qid'."""
+    paths = sorted(glob(pattern))
+    if not paths:
+        raise FileNotFoundError(f"No score files match '{pattern}'")
+
+    return polars.concat([
+        polars.scan_parquet(path).with_columns(qid=polars.lit(re.sub(r'_normalized_score\.parquet$', '', os.path.basename(path))))
+        for path in paths
+    ])
+
+def select_context(scores: polars.LazyFrame,
+                   chunks: polars.LazyFrame,
+                   token_counts: polars.LazyFrame,
+                   presidencies: polars.DataFrame,
+                   max_tokens: int = DEFAULT_MAX_TOKENS) -> polars.LazyFrame:
+    """
+    Los chunks seleccionados para cada (qid, presidente), con las mismas columnas que los
+    relevant_chunks_*.parquet de get_prompts.ipynb más 'qid'.
+    'chunks' tiene (vector_id, source), 'token_counts' (vector_id, token_count).
+    """
+    cumsum, budget = within_budget(max_tokens, PARTITIONS)
+
+    return (scores
+            .join(chunks.select('vector_id', 'source'), on='vector_id', how='left')
+            .join(token_counts.select('vector_id', 'token_count'), on='vector_id', how='left')
+            .with_columns(file=file_name(polars.col('source')))
+            .join(presidencies.lazy(), on='file')
+            .drop('file')
+            .sort('normalized_score', descending=True, maintain_order=True)
+            .with_columns(cumsum)
+            .filter(budget))
+
+def write_dataset(selected: polars.LazyFrame, output: str = DEFAULT_OUTPUT) -> polars.DataFrame:
+    """Ejecuta la consulta y la escribe particionada por qid y presidente, reemplazando lo que hubiera."""
+    df = selected.collect(streaming=True)
+
+    if os.path.exists(output):
+        shutil.rmtree(output)
+
+    df.write_parquet(output, partition_by=PARTITIONS)
+    return df
+
+def read_dataset(output: str = DEFAULT_OUTPUT) -> polars.LazyFrame:
+    return polars.scan_parquet(os.path.join(output, '**', '*.parquet'), hive_partitioning=True)
+
+def count_tokens(embeddings: str, tokenizer: str) -> polars.LazyFrame:
+    """(vector_id, token_count) de cada chunk, contados con 'tokenizer' (con cache, ver token_counts.py)."""
+    from token_counts import TokenCounter
+    counter = TokenCounter(tokenizer)
+    counts = counter.frame(polars.read_parquet(embeddings, columns=['vector_id', 'text']))
+    print(counter.stats())
+    return counts.lazy()
+
+def main(scores: str, embeddings: str, token_counts: str, tokenizer: str | None, presidencies: str, max_tokens: int, output: str):
+    selected = select_context(scan_scores(scores),
+                              polars.scan_parquet(embeddings),
+                              count_tokens(embeddings, tokenizer) if tokenizer else polars.scan_parquet(token_counts),
+                              presidencies_frame(presidencies),
+                              max_tokens)
+    df = write_dataset(selected, output)
+    print(f"{len(df)} chunks selected for {df.select(PARTITIONS).n_unique()} (question, president) pairs, written to {output}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scores', type=str, default='../data/q*_normalized_score.parquet', help='Glob of the normalized score files')
+    parser.add_argument('--embeddings', type=str, default='../data/arg_embeddings.parquet', help='Parquet with the vector_id and source of each chunk')
+    parser.add_argument('--token-counts', type=str, default='../data/arg_token_counts.parquet', help='Parquet with the token_count of each chunk')
+    parser.add_argument('--tokenizer', type=str, default=None, help='Count tokens with this tokenizer (cached) instead of reading --token-counts')
+    parser.add_argument('--presidencies', type=str, default='../data/docs_por_presidencia.json')
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_TOKENS, help='Token budget of the context of each (question, president)')
+    parser.add_argument('-o','--output', type=str, default=DEFAULT_OUTPUT, help='Folder of the partitioned dataset')
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,241 @@
+import numpy
+from hashlib import blake2b
+from os import makedirs, replace
+from os.path import join as join_paths, exists
+from collections.abc import Sequence
+from time import perf_counter
+import json
+
+def model_slug(model_name: str) -> str:
+    return model_name.replace('/', '__')
+
+def text_key(text: str) -> bytes:
+    return blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+class EmbeddingCache:
+    """
+    Cache persistente de embeddings para un modelo.
+
+    Los vectores se guardan en una matriz memory-mapped ('vectors.bin')
+    y un índice hash del texto -> fila ('index.npz'). Cuando se supera
+    'max_size_mb' se desalojan las filas usadas hace más tiempo; el índice
+    sin esas filas se guarda antes de reutilizarlas, para que un corte a
+    mitad de camino no deje en disco un índice que apunte a vectores de
+    otros textos.
+    Uso:
+    >>> cache = EmbeddingCache('./cache/embeddings', 'sentence-transformers/all-mpnet-base-v2', dim=768)
+    >>> vectors, missing = cache.get_many(texts)
+    """
+    vectors_filename = 'vectors.bin'
+    index_filename = 'index.npz'
+    meta_filename = 'meta.json'
+
+    def __init__(self, folder: str, model_name: str, dim: int, dtype='float32', max_size_mb: float = 2048):
+        self.folder = join_paths(folder, model_slug(model_name))
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = numpy.dtype(dtype)
+        self.capacity = max(1, int(max_size_mb * 2**20) // (dim * self.dtype.itemsize))
+
+        self.rows: dict[bytes, int] = {}
+        self.last_used = numpy.zeros((0,), dtype=numpy.int64)
+        self.free_rows: list[int] = []
+        self.tick = 0
+        self.allocated = 0
+        self.matrix = None
+
+        makedirs(self.folder, exist_ok=True)
+        self._load()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def vectors_path(self):
+        return join_paths(self.folder, self.vectors_filename)
+
+    def _load(self):
+        meta_path = join_paths(self.folder, self.meta_filename)
+        index_path = join_paths(self.folder, self.index_filename)
+
+        if exists(meta_path) and exists(index_path) and exists(self.vectors_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+            if meta['dim'] != self.dim or meta['dtype'] != self.dtype.name:
+                raise ValueError(f"Embedding cache at {self.folder} was built with dim={meta['dim']} and "
+                                 f"dtype={meta['dtype']}, expected dim={self.dim} and dtype={self.dtype.name}")
+
+            index = numpy.load(index_path)
+            keys, rows = index['keys'], index['rows']
+            self.allocated = int(meta['allocated'])
+            self.tick = int(meta['tick'])
+            self.last_used = numpy.zeros((self.allocated,), dtype=numpy.int64)
+            self.last_used[rows] = index['last_used']
+            self.rows = {k.tobytes(): int(r) for k, r in zip(keys, rows)}
+            self.free_rows = sorted(set(range(self.allocated)) - set(self.rows.values()), reverse=True)
+            self._open(self.allocated)
+
+    def _open(self, rows: int):
+        if rows == 0:
+            self.matrix = None
+            return
+
+        self.matrix = numpy.memmap(self.vectors_path, dtype=self.dtype, mode='r+', shape=(rows, self.dim))
+
+    def _reserve(self, n: int):
+        """Agranda el archivo de vectores para que entren 'n' filas nuevas, sin pasar la capacidad."""
+        needed = min(self.capacity, self.allocated + max(0, n - len(self.free_rows)))
+        if needed <= self.allocated:
+            return
+
+        new_allocated = min(self.capacity, max(needed, 2 * self.allocated))
+
+        if self.matrix is not None:
+            self.matrix.flush()
+
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(new_allocated * self.dim * self.dtype.itemsize)
+
+        self.free_rows = list(range(new_allocated - 1, self.allocated - 1, -1)) + self.free_rows
+        self.last_used = numpy.concatenate([self.last_used, numpy.zeros((new_allocated - self.allocated,), dtype=numpy.int64)])
+        self.allocated = new_allocated
+        self._open(self.allocated)
+
+    def _evict(self, n: int, protected: set[int]):
+        """
+        Libera 'n' filas, empezando por las usadas hace más tiempo. Las filas
+        liberadas no se pueden escribir hasta que se guarde el índice (ver put_many).
+        """
+        candidates = numpy.argsort(self.last_used, kind='stable')
+        row_to_key = {r: k for k, r in self.rows.items()}
+
+        evicted = 0
+        for row in candidates:
+            if evicted == n:
+                break
+            row = int(row)
+            if row in protected or row not in row_to_key:
+                continue
+            del self.rows[row_to_key[row]]
+            self.free_rows.append(row)
+            evicted += 1
+
+    def get_many(self, texts: Sequence[str]) -> tuple[numpy.ndarray, list[int]]:
+        """
+        Devuelve una matriz (len(texts), dim) en float32 con los vectores cacheados
+        y la lista de posiciones que no estaban en el cache.
+        """
+        self.tick += 1
+        vectors = numpy.zeros((len(texts), self.dim), dtype=numpy.float32)
+        missing = []
+
+        for i, text in enumerate(texts):
+            row = self.rows.get(text_key(text))
+            if row is None:
+                missing.append(i)
+            else:
+                vectors[i] = self.matrix[row]
+                self.last_used[row] = self.tick
+
+        return vectors, missing
+
+    def put_many(self, texts: Sequence[str], vectors: numpy.ndarray):
+        keys = list(dict.fromkeys(k for k in map(text_key, texts) if k not in self.rows))
+        positions = {k: i for i, k in enumerate(map(text_key, texts))}
+
+        if not keys:
+            return
+
+        keys = keys[-self.capacity:]
+        self._reserve(len(keys))
+
+        if len(self.free_rows) < len(keys):
+            protected = set(numpy.flatnonzero(self.last_used == self.tick).tolist())
+            # Se libera de más (5% de la capacidad) para no guardar el índice en cada batch
+            self._evict(max(len(keys) - len(self.free_rows), self.capacity // 20), protected)
+            self.save()
+            keys = keys[max(0, len(keys) - len(self.free_rows)):]
+
+        for key in keys:
+            row = self.free_rows.pop()
+            self.matrix[row] = vectors[positions[key]]
+            self.rows[key] = row
+            self.last_used[row] = self.tick
+
+    def save(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+
+        keys = numpy.frombuffer(b''.join(self.rows.keys()), dtype=numpy.uint8).reshape(-1, 16)
+        rows = numpy.fromiter(self.rows.values(), dtype=numpy.int64, count=len(self.rows))
+
+        # Primero meta.json ('allocated' sólo crece) y después el índice, cada uno
+        # reemplazado de forma atómica: el índice en disco nunca apunta a filas fuera
+        # del archivo ni a filas desalojadas después de guardarlo.
+        meta_path = join_paths(self.folder, self.meta_filename)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(dict(model_name=self.model_name,
+                           dim=self.dim,
+                           dtype=self.dtype.name,
+                           allocated=self.allocated,
+                           tick=self.tick), f)
+        replace(meta_path + '.tmp', meta_path)
+
+        index_path = join_paths(self.folder, self.index_filename)
+        with open(index_path + '.tmp', 'wb') as f:
+            numpy.savez(f,
+                        keys=keys,
+                        rows=rows,
+                        last_used=self.last_used[rows])
+        replace(index_path + '.tmp', index_path)
+
+class CachedEncoder:
+    """
+    Envoltorio de un SentenceTransformer que consulta el cache
+    antes de codificar, y solo le pasa al modelo los textos faltantes.
+    El resto de los atributos se delegan en el modelo. El cache se guarda
+    cada 'save_interval' segundos, además de al llamar a save().
+    """
+    def __init__(self, model, cache: EmbeddingCache, save_interval: float = 300):
+        self.model = model
+        self.cache = cache
+        self.save_interval = save_interval
+        self.last_saved = perf_counter()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def encode(self, sentences: Sequence[str], **kwargs) -> numpy.ndarray:
+        sentences = list(sentences)
+        vectors, missing = self.cache.get_many(sentences)
+
+        self.hits += len(sentences) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            unique_missing = list(dict.fromkeys(sentences[i] for i in missing))
+            kwargs = kwargs | dict(convert_to_numpy=True)
+            encoded = numpy.asarray(self.model.encode(unique_missing, **kwargs), dtype=numpy.float32)
+
+            by_text = dict(zip(unique_missing, encoded))
+            for i in missing:
+                vectors[i] = by_text[sentences[i]]
+
+            self.cache.put_many(unique_missing, encoded)
+
+            if perf_counter() - self.last_saved >= self.save_interval:
+                self.save()
+
+        return vectors
+
+    def save(self):
+        self.cache.save()
+        self.last_saved = perf_counter()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0
+        return f"Embedding cache: {self.hits} hits, {self.misses} misses ({ratio:.1%} hit ratio), {len(self.cache)} cached vectors."
@@ -0,0 +1,61 @@
+import numpy
+from time import perf_counter
+from collections.abc import Sequence
+
+class BucketedEncoder:
+    """
+    Envoltorio de un SentenceTransformer que ordena los textos por cantidad
+    de tokens y los codifica en lotes de 'batch_size' textos de largo parecido,
+    para no desperdiciar cómputo en padding. Devuelve los vectores en el orden
+    original y lleva la cuenta de chunks y tokens procesados por segundo.
+    El resto de los atributos se delegan en el modelo.
+    """
+    def __init__(self, model, batch_size: int = 32):
+        self.model = model
+        self.batch_size = batch_size
+        self.chunks = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def token_lengths(self, sentences: Sequence[str]) -> numpy.ndarray:
+        encoded = self.model.tokenizer(list(sentences),
+                                       truncation=True,
+                                       max_length=self.model.max_seq_length)
+        return numpy.fromiter(map(len, encoded['input_ids']), dtype=numpy.int64, count=len(sentences))
+
+    def encode(self, sentences: Sequence[str], **kwargs) -> numpy.ndarray:
+        sentences = list(sentences)
+        for key in ('batch_size', 'convert_to_numpy', 'show_progress_bar'):
+            kwargs.pop(key, None)
+
+        start = perf_counter()
+
+        lengths = self.token_lengths(sentences)
+        order = numpy.argsort(-lengths, kind='stable')
+        embeddings = numpy.empty((len(sentences), self.model.get_sentence_embedding_dimension()), dtype=numpy.float32)
+
+        for i in range(0, len(sentences), self.batch_size):
+            batch = order[i:i + self.batch_size]
+            embeddings[batch] = self.model.encode([sentences[j] for j in batch],
+                                                  batch_size=len(batch),
+                                                  convert_to_numpy=True,
+                                                  show_progress_bar=False,
+                                                  **kwargs)
+            self.padded_tokens += int(lengths[batch].max()) * len(batch)
+
+        self.seconds += perf_counter() - start
+        self.chunks += len(sentences)
+        self.tokens += int(lengths.sum())
+
+        return embeddings
+
+    def report(self) -> str:
+        seconds = self.seconds or float('inf')
+        padding = 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0
+        return (f"Encoded {self.chunks} chunks ({self.tokens} tokens) in {self.seconds:.1f}s: "
+                f"{self.chunks / seconds:.2f} chunks/s, {self.tokens / seconds:.1f} tokens/s, "
+                f"{padding:.1%} padding.")
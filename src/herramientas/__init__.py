@@ -1,2 +1,2 @@
 from .ollama import AsyncOllamaClient
-from .concurrent import Machine, Orchestrator
\ No newline at end of file
+from .concurrent import Machine, Orchestrator, JsonlResultSink, JsonFilesResultSink
\ No newline at end of file
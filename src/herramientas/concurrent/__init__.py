@@ -1,2 +1,4 @@
 from .orchestrator import Orchestrator
-from .machine import Machine
\ No newline at end of file
+from .machine import Machine
+from .sink import JsonlResultSink, JsonFilesResultSink
+from .journal import TaskJournal
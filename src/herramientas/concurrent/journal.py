@@ -0,0 +1,69 @@
+from collections import Counter
+from typing import Any, Dict, List, Sequence
+import threading
+import hashlib
+import json
+import os
+
+def task_fingerprint(task: Any) -> str:
+    return hashlib.sha256(json.dumps(task, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class TaskJournal:
+    """
+    Registro append-only (JSONL) de las tareas terminadas de un run_tasks, para poder
+    retomarlo: cada línea tiene el índice de la tarea, su fingerprint y la respuesta
+    (o el error, si falló después de todos los reintentos). Cada registro se escribe
+    con fsync antes de darlo por hecho.
+
+    Una tarea se considera hecha si el journal tiene una respuesta con su fingerprint.
+    Las tareas repetidas (mismo fingerprint) se cuentan por ocurrencia: si la lista
+    tiene tres copias de una tarea y el journal dos respuestas, queda una pendiente.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.responses: Dict[str, List[dict]] = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break # Última línea a medio escribir
+                    record = json.loads(line)
+                    if 'response' in record:
+                        self.responses.setdefault(record['fingerprint'], []).append(record['response'])
+
+    def __len__(self) -> int:
+        return sum(map(len, self.responses.values()))
+
+    def completed(self, tasks: Sequence[Any]) -> Dict[int, dict]:
+        """{índice: respuesta guardada} de las tareas de 'tasks' que ya están hechas."""
+        used: Counter = Counter()
+        done = {}
+        for index, task in enumerate(tasks):
+            fingerprint = task_fingerprint(task)
+            saved = self.responses.get(fingerprint, [])
+            if used[fingerprint] < len(saved):
+                done[index] = saved[used[fingerprint]]
+                used[fingerprint] += 1
+        return done
+
+    def _append(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def record_response(self, index: int, task: Any, response: dict):
+        fingerprint = task_fingerprint(task)
+        self._append(dict(index=index, fingerprint=fingerprint, response=response))
+        self.responses.setdefault(fingerprint, []).append(response)
+
+    def record_error(self, index: int, task: Any, error: BaseException, attempts: int):
+        self._append(dict(index=index, fingerprint=task_fingerprint(task), error=repr(error), attempts=attempts))
@@ -32,7 +32,9 @@ class Machine(IMachine[OllamaArgs, OllamaResponse]):
         #assert isinstance(task, dict)
 
         self.busy = True
-        result = await self.client.generate(**task)
+        try:
+            result = await self.client.generate(**task)
+        finally:
+            self.busy = False
 
-        self.busy = False
         return task_index, result
\ No newline at end of file
@@ -1,50 +1,121 @@
-from .types import IOrchestrator
+from .types import IOrchestrator, IResultSink
 from .machine import Machine
+from .sink import JsonFilesResultSink
+from .journal import TaskJournal
 import asyncio
 from tqdm import tqdm # type: ignore
-from typing import MutableSequence, List, Sequence, Optional
-from typing import cast, assert_type
+from typing import MutableSequence, List, Sequence, Optional, Dict
+from typing import assert_type
+from functools import partial
 from fundar_llms.api.ollama import OllamaResponse # type: ignore
+from ..ollama.async_ollama_client import OllamaResponse as ClientResponse
 from ..ollama.types import OllamaArgs
-from fundar import json
 
 class Orchestrator(IOrchestrator):
     machines: List[Machine]
+    sink: IResultSink[OllamaResponse]
 
-    def __init__(self, machines: List[Machine]):
+    def __init__(self, machines: List[Machine], sink: Optional[IResultSink[OllamaResponse]] = None):
         self.machines = machines
+        # Por defecto, un JSON por respuesta en ../data como antes
+        self.sink = sink if sink is not None else JsonFilesResultSink('../data')
+
+    async def run_tasks(self,
+                        tasks_p: Sequence[OllamaArgs],
+                        journal_path: Optional[str] = None,
+                        timeout: Optional[float] = None,
+                        max_retries: int = 0,
+                        backoff: float = 5.0) -> List[Optional[OllamaResponse]]:
+        """
+        Ejecuta las tareas repartidas entre las máquinas y devuelve las respuestas en el
+        orden de 'tasks_p'.
+        - journal_path: JSONL donde se registra cada tarea terminada (ver TaskJournal). Si
+          ya existe, las tareas hechas no se vuelven a ejecutar y su respuesta se
+          reconstruye de lo guardado en el journal. Una tarea se anota en el journal
+          recién cuando el sink la escribió en disco, así que una tarea retomada nunca
+          falta en el sink (si se corta entre las dos escrituras, puede quedar repetida).
+        - timeout: segundos máximos por intento de cada tarea.
+        - max_retries: reintentos de una tarea que falló o se pasó del timeout, esperando
+          backoff * 2**(intento - 1) segundos; se reencola para que la tome cualquier máquina,
+          y mientras tanto la máquina que falló sigue con otras tareas.
+        Las tareas que fallan todos los intentos quedan en None.
+        """
+        journal = TaskJournal(journal_path) if journal_path else None
+        done = journal.completed(tasks_p) if journal is not None else {}
 
-    async def run_tasks(self, tasks_p: Sequence[OllamaArgs]):
         task_queue: asyncio.Queue[Optional[tuple[int, OllamaArgs]]] = asyncio.Queue()
 
         for index, task in enumerate(tasks_p):
-            await task_queue.put((index, task))
+            if index not in done:
+                await task_queue.put((index, task))
 
         total_tasks = len(tasks_p)
         results: List[Optional[OllamaResponse]] = [None] * total_tasks
-        
-        pbar = tqdm(total=total_tasks)
+        for index, response in done.items():
+            # El mismo result.to_dict() que escribe el sink; from_dict es el de AsyncOllamaClient.generate
+            results[index] = ClientResponse.from_dict(response)
+
+        if done:
+            print(f"{len(done)} tasks already done in {journal_path}, {total_tasks - len(done)} pending")
+
+        pbar = tqdm(total=total_tasks, initial=len(done))
+        attempts: Dict[int, int] = {}
 
         workers = [
-            asyncio.create_task(self.worker(machine, results, task_queue, pbar))
+            asyncio.create_task(self.worker(machine, results, task_queue, pbar, journal, timeout, max_retries, backoff, attempts))
             for machine in self.machines
         ]
 
-        await task_queue.join()
+        # Los workers sólo terminan antes que la cola si algo falla fuera de la tarea
+        # (journal, sink); en ese caso se corta en lugar de esperar para siempre.
+        try:
+            join = asyncio.create_task(task_queue.join())
+            await asyncio.wait([join, *workers], return_when=asyncio.FIRST_COMPLETED)
+
+            if not join.done():
+                join.cancel()
+                for worker in workers:
+                    worker.cancel()
+                pbar.close()
+                failed = next(worker for worker in workers if worker.done() and not worker.cancelled() and worker.exception())
+                raise failed.exception() # type: ignore
+
+            for _ in self.machines:
+                await task_queue.put(None)
+
+            await asyncio.gather(*workers)
+            pbar.close()
+
+        except BaseException:
+            # Lo encolado se escribe aunque algún worker haya fallado, pero si el flush también
+            # falla se avisa y se propaga el error original
+            try:
+                await asyncio.to_thread(self.sink.flush)
+            except Exception as flush_error:
+                tqdm.write(f"Could not flush the result sink: {flush_error!r}")
+            raise
 
-        for _ in self.machines:
-            await task_queue.put(None)
+        # Espera a que el sink termine de escribir sin bloquear el event loop
+        await asyncio.to_thread(self.sink.flush)
 
-        await asyncio.gather(*workers)
-        pbar.close()
-        
-        return cast(List[OllamaResponse], results)
+        failed_tasks = sum(1 for result in results if result is None)
+        if failed_tasks:
+            print(f"{failed_tasks} tasks failed after {max_retries + 1} attempts")
+
+        return results
 
     async def worker(self, 
                      machine: Machine, 
-                     results: MutableSequence[OllamaResponse], 
+                     results: MutableSequence[Optional[OllamaResponse]], 
                      task_queue: asyncio.Queue, 
-                     pbar: tqdm):
+                     pbar: tqdm,
+                     journal: Optional[TaskJournal] = None,
+                     timeout: Optional[float] = None,
+                     max_retries: int = 0,
+                     backoff: float = 5.0,
+                     attempts: Optional[Dict[int, int]] = None):
+        attempts = attempts if attempts is not None else {}
+
         while True:
             task_data: Optional[tuple[int, OllamaArgs]] = await task_queue.get()
 
@@ -53,33 +124,41 @@ class Orchestrator(IOrchestrator):
                 break
 
             assert_type(task_data, tuple[int, OllamaArgs])
+            (task_index, task) = task_data
+            requeued = False
 
-            task_index, result = await machine.execute(task_data)
-            results[task_index] = result
-
-            ### MODIFICACION AD-HOC
-
-            result.extra['run_on'] = machine.name
-            extra = result.extra
-            
             try:
-                qid = extra['qid']
-            except Exception as ex:
-                qid = ''
+                _, result = await asyncio.wait_for(machine.execute(task_data), timeout)
 
-            try:
-                presidente = extra['presidente']
             except Exception as ex:
-                presidente = ''
-            
-            timestamp = result.created_at.replace(':', '_').replace('.', '__')
-            name = f'../data/{qid}-{presidente}_{timestamp}.json'
-            json.dump(
-                result.to_dict(),
-                name
-            )
-
-            ### ====================
-
-            task_queue.task_done()
-            pbar.update(1)
\ No newline at end of file
+                attempt = attempts[task_index] = attempts.get(task_index, 0) + 1
+
+                if attempt <= max_retries:
+                    tqdm.write(f"{machine.name}: task {task_index} failed ({ex!r}), retry {attempt}/{max_retries}")
+                    # Se reencola más tarde sin frenar a este worker; el task_done lo hace
+                    # _requeue después del put, así la cola no se da por terminada mientras tanto
+                    asyncio.get_running_loop().call_later(backoff * 2 ** (attempt - 1), self._requeue, task_queue, task_data)
+                    requeued = True
+                else:
+                    tqdm.write(f"{machine.name}: task {task_index} failed after {attempt} attempts ({ex!r})")
+                    if journal is not None:
+                        await asyncio.to_thread(journal.record_error, task_index, task, ex, attempt)
+                    pbar.update(1)
+
+            else:
+                result.extra['run_on'] = machine.name
+                # El journal se escribe desde el hilo del sink, después de que el sink guardó la respuesta
+                on_written = partial(journal.record_response, task_index, task, result.to_dict()) if journal is not None else None
+
+                results[task_index] = result
+                self.sink.put(result, on_written)
+                pbar.update(1)
+
+            finally:
+                if not requeued:
+                    task_queue.task_done()
+
+    @staticmethod
+    def _requeue(task_queue: asyncio.Queue, task_data: tuple[int, OllamaArgs]):
+        task_queue.put_nowait(task_data)
+        task_queue.task_done()
\ No newline at end of file
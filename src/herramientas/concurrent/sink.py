@@ -0,0 +1,160 @@
+from .types import IResultSink
+from fundar_llms.api.ollama import OllamaResponse # type: ignore
+from typing import Iterator, List, Optional, Callable, Tuple
+from abc import abstractmethod
+from fundar import json as fundar_json
+import threading
+import atexit
+import queue
+import json
+import time
+import os
+
+class ThreadedResultSink(IResultSink[OllamaResponse]):
+    """
+    Encola las respuestas y las escribe desde un hilo aparte, de a batches: cuando
+    se juntan 'max_batch' respuestas, cuando pasan 'max_delay' segundos desde la
+    primera respuesta pendiente, y al hacer flush o close.
+    Las subclases implementan 'write_batch', que tiene que dejar el batch en disco (fsync)
+    antes de volver: recién entonces se llaman los 'on_written' de sus respuestas.
+    Al salir del intérprete se cierra solo (atexit), así no se pierde lo que quedó en la cola.
+    """
+    _FLUSH = object()
+    _CLOSE = object()
+
+    def __init__(self, max_batch: int = 64, max_delay: float = 5.0):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue: queue.Queue = queue.Queue()
+        self.error: Optional[BaseException] = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    @abstractmethod
+    def write_batch(self, results: List[OllamaResponse]) -> None: ...
+
+    def put(self, result: OllamaResponse, on_written: Optional[Callable[[], None]] = None) -> None:
+        if self.closed:
+            raise RuntimeError(f'{type(self).__name__} is closed')
+        if self.error is not None:
+            raise RuntimeError(f'{type(self).__name__} failed to write results') from self.error
+        self.queue.put((result, on_written))
+
+    def flush(self) -> None:
+        """Bloquea hasta que se escribió todo lo encolado."""
+        if not self.closed:
+            self.queue.put(self._FLUSH)
+            self.queue.join()
+        if self.error is not None:
+            raise RuntimeError(f'{type(self).__name__} failed to write results') from self.error
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.queue.put(self._CLOSE)
+            self.thread.join()
+            atexit.unregister(self.close)
+        if self.error is not None:
+            raise RuntimeError(f'{type(self).__name__} failed to write results') from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _write(self, pending: List[Tuple[OllamaResponse, Optional[Callable[[], None]]]]):
+        if not pending:
+            return
+        try:
+            self.write_batch([result for result, _ in pending])
+            for _, on_written in pending:
+                if on_written is not None:
+                    on_written()
+        except BaseException as ex:
+            # Se guarda para avisar en el próximo put/flush/close; el hilo sigue vaciando la cola
+            self.error = ex
+        finally:
+            for _ in pending:
+                self.queue.task_done()
+            pending.clear()
+
+    def _run(self):
+        pending: List[Tuple[OllamaResponse, Optional[Callable[[], None]]]] = []
+        deadline: Optional[float] = None
+
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write(pending)
+                deadline = None
+                continue
+
+            if item is self._FLUSH or item is self._CLOSE:
+                self._write(pending)
+                deadline = None
+                self.queue.task_done()
+                if item is self._CLOSE:
+                    return
+                continue
+
+            pending.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.max_delay
+
+            if len(pending) >= self.max_batch:
+                self._write(pending)
+                deadline = None
+
+class JsonlResultSink(ThreadedResultSink):
+    """
+    Agrega cada respuesta (result.to_dict()) como una línea de 'path'.
+    Uso:
+    >>> orchestrator = Orchestrator(machines, sink=JsonlResultSink('../data/responses/responses.jsonl'))
+    """
+    def __init__(self, path: str = '../data/responses/responses.jsonl', max_batch: int = 64, max_delay: float = 5.0):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        super().__init__(max_batch, max_delay)
+
+    def write_batch(self, results: List[OllamaResponse]) -> None:
+        lines = ''.join(json.dumps(result.to_dict(), ensure_ascii=False, default=str) + '\n' for result in results)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    """Las respuestas escritas por JsonlResultSink; ignora una última línea incompleta."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            yield json.loads(line)
+
+def result_file_name(result: OllamaResponse, directory: str) -> str:
+    """'{directory}/{qid}-{presidente}_{timestamp}.json', el nombre que usaba Orchestrator.worker."""
+    extra = result.extra
+    qid = extra.get('qid', '')
+    presidente = extra.get('presidente', '')
+    timestamp = result.created_at.replace(':', '_').replace('.', '__')
+    return os.path.join(directory, f'{qid}-{presidente}_{timestamp}.json')
+
+class JsonFilesResultSink(ThreadedResultSink):
+    """Un archivo JSON por respuesta, como antes, pero escrito desde el hilo del sink."""
+    def __init__(self, directory: str = '../data', max_batch: int = 64, max_delay: float = 5.0):
+        self.directory = directory
+        super().__init__(max_batch, max_delay)
+
+    def write_batch(self, results: List[OllamaResponse]) -> None:
+        for result in results:
+            path = result_file_name(result, self.directory)
+            fundar_json.dump(result.to_dict(), path)
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
@@ -1,6 +1,6 @@
 from abc import ABC as AbstractBaseClass, abstractmethod
 from fundar_llms.api.interface import PlainPromptInterface # type: ignore
-from typing import Tuple, TypeVar, Generic, Sequence
+from typing import Tuple, TypeVar, Generic, Sequence, Callable, Optional
 
 T = TypeVar('T') # tipo de la Task
 R = TypeVar('R') # tipo de la Respuesta
@@ -23,4 +23,18 @@ class IOrchestrator(Generic[T, R], AbstractBaseClass):
     async def run_tasks(
         self, 
         tasks_p: Sequence[T]
-        ) -> Sequence[R]: ...
\ No newline at end of file
+        ) -> Sequence[R]: ...
+
+class IResultSink(Generic[R], AbstractBaseClass):
+    # Destino de las respuestas. 'put' no tiene que bloquear el event loop:
+    # la escritura a disco la hace otro hilo. 'on_written' se llama (desde ese
+    # hilo) recién cuando la respuesta quedó escrita en disco.
+
+    @abstractmethod
+    def put(self, result: R, on_written: Optional[Callable[[], None]] = None) -> None: ...
+
+    @abstractmethod
+    def flush(self) -> None: ...
+
+    @abstractmethod
+    def close(self) -> None: ...
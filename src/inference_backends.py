@@ -0,0 +1,146 @@
+import numpy
+from os.path import join as join_paths, exists
+from collections.abc import Sequence
+
+BACKENDS = ['torch', 'onnx', 'onnx-int8']
+DEFAULT_MODELS_FOLDER = './cache/models'
+
+# Configuración de cuantización dinámica de onnxruntime.
+# 'avx2' funciona en cualquier CPU x86 moderna; 'avx512_vnni' o 'arm64' rinden más donde están disponibles.
+DEFAULT_QUANTIZATION = 'avx2'
+
+def model_slug(model_name: str) -> str:
+    return model_name.replace('/', '__')
+
+def exported_model_path(model_name: str, backend: str, models_folder: str, quantization: str) -> str:
+    suffix = f'{backend}-{quantization}' if backend == 'onnx-int8' else backend
+    return join_paths(models_folder, f'{model_slug(model_name)}-{suffix}')
+
+def check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Invalid backend '{backend}'. Expected one of {BACKENDS}")
+
+def load_embedding_model(model_name: str,
+                         backend: str = 'torch',
+                         device: str = 'cpu',
+                         models_folder: str = DEFAULT_MODELS_FOLDER,
+                         quantization: str = DEFAULT_QUANTIZATION):
+    """
+    Carga un SentenceTransformer con el backend pedido. Para 'onnx' y 'onnx-int8'
+    el modelo se exporta (y cuantiza) la primera vez y se guarda en 'models_folder',
+    las siguientes veces se carga directamente de ahí.
+    """
+    from sentence_transformers import SentenceTransformer
+    check_backend(backend)
+
+    if backend == 'torch':
+        return SentenceTransformer(model_name, device=device)
+
+    path = exported_model_path(model_name, backend, models_folder, quantization)
+    file_name = 'onnx/model_qint8.onnx' if backend == 'onnx-int8' else 'onnx/model.onnx'
+
+    if not exists(join_paths(path, file_name)):
+        model = SentenceTransformer(model_name, backend='onnx', device=device)
+        model.save_pretrained(path)
+
+        if backend == 'onnx-int8':
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            export_dynamic_quantized_onnx_model(model, quantization, path, file_suffix='qint8')
+
+    return SentenceTransformer(path, backend='onnx', device=device, model_kwargs=dict(file_name=file_name))
+
+class OnnxCrossEncoder:
+    """
+    CrossEncoder sobre onnxruntime, con la misma interfaz de 'predict'
+    que sentence_transformers.CrossEncoder y la misma función de activación
+    por defecto (la que indica la configuración del modelo).
+    """
+    def __init__(self, model, tokenizer, max_length: int | None = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_length = max_length or tokenizer.model_max_length
+
+        config = model.config
+        activation = getattr(config, 'sbert_ce_default_activation_function', None)
+        if activation is None:
+            self.apply_sigmoid = config.num_labels == 1
+        else:
+            self.apply_sigmoid = activation.endswith('Sigmoid')
+
+    def predict(self,
+                sentences: Sequence[tuple[str, str]],
+                batch_size: int = 32,
+                show_progress_bar: bool | None = None,
+                convert_to_numpy: bool = True,
+                **kwargs) -> numpy.ndarray:
+        from tqdm.auto import tqdm
+
+        sentences = list(sentences)
+        scores = []
+        starts = range(0, len(sentences), batch_size)
+
+        for i in tqdm(starts, disable=not show_progress_bar):
+            first, second = zip(*sentences[i:i + batch_size])
+            features = self.tokenizer(list(first), list(second),
+                                      padding=True,
+                                      truncation='longest_first',
+                                      max_length=self.max_length,
+                                      return_tensors='np')
+            logits = numpy.asarray(self.model(**features).logits, dtype=numpy.float32)
+            scores.append(logits)
+
+        scores = numpy.concatenate(scores) if scores else numpy.zeros((0, 1), dtype=numpy.float32)
+
+        if self.apply_sigmoid:
+            scores = 1 / (1 + numpy.exp(-scores))
+
+        if self.model.config.num_labels == 1:
+            scores = scores[:, 0]
+
+        return scores
+
+def load_reranker(model_name: str,
+                  backend: str = 'torch',
+                  device: str = 'cpu',
+                  models_folder: str = DEFAULT_MODELS_FOLDER,
+                  quantization: str = DEFAULT_QUANTIZATION,
+                  threads: int | None = None):
+    """
+    Carga un CrossEncoder con el backend pedido. Para 'onnx' y 'onnx-int8'
+    se exporta con optimum la primera vez y se guarda en 'models_folder'.
+    'threads' limita los hilos de inferencia en CPU (por defecto, todos).
+    """
+    check_backend(backend)
+
+    if backend == 'torch':
+        from sentence_transformers import CrossEncoder
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return CrossEncoder(model_name=model_name, device=device)
+
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    path = exported_model_path(model_name, backend, models_folder, quantization)
+    file_name = 'model_quantized.onnx' if backend == 'onnx-int8' else 'model.onnx'
+
+    if not exists(join_paths(path, file_name)):
+        model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+        model.save_pretrained(path)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(path)
+
+        if backend == 'onnx-int8':
+            quantization_config = getattr(AutoQuantizationConfig, quantization)(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(model).quantize(save_dir=path, quantization_config=quantization_config)
+
+    session_options = None
+    if threads:
+        from onnxruntime import SessionOptions
+        session_options = SessionOptions()
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+
+    model = ORTModelForSequenceClassification.from_pretrained(path, file_name=file_name, session_options=session_options)
+    return OnnxCrossEncoder(model, AutoTokenizer.from_pretrained(path))
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+# Empaquetado de los prompts para Ollama: mide el largo exacto en tokens del prompt tal como
+# lo ve el modelo (template de chat + system + pregunta + contexto), recorta el contexto si no
+# entra, y calcula el num_ctx más chico que alcanza, redondeado a un bucket. Cada cambio de
+# num_ctx hace que Ollama recargue el modelo, por eso los buckets son pocos y conviene mandar
+# las tareas ordenadas por num_ctx (ver sort_by_num_ctx).
+
+from dataclasses import dataclass
+from collections.abc import Sequence
+from bisect import bisect_left
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from herramientas.ollama.types import OllamaArgs
+
+NUM_CTX_BUCKETS = (2048, 4096, 8192, 12288, 16384, 24576, 32768, 49152, 65536, 98304, 131072)
+DEFAULT_MAX_CTX = 131072 # llama3.2
+
+def num_ctx_for(tokens: int, buckets: Sequence[int] = NUM_CTX_BUCKETS) -> int:
+    """El bucket más chico que tiene lugar para 'tokens'."""
+    i = bisect_left(buckets, tokens)
+    if i == len(buckets):
+        raise ValueError(f"{tokens} tokens don't fit in the largest num_ctx bucket ({buckets[-1]})")
+    return buckets[i]
+
+@dataclass
+class PackedPrompt:
+    prompt: str
+    prompt_tokens: int
+    num_ctx: int
+    chunks_used: int
+    chunks_total: int
+
+    @property
+    def truncated(self) -> bool:
+        return self.chunks_used < self.chunks_total
+
+class PromptPacker:
+    """
+    Arma el prompt de una pregunta con la mayor cantidad de chunks (en el orden dado, que
+    es el de score) que entran en 'max_ctx' junto con la respuesta ('num_predict' tokens),
+    y el num_ctx que necesita.
+    Uso:
+    >>> packer = PromptPacker(tokenizer, system_prompt, prompt_template, num_predict=600)
+    >>> packed = packer.pack(pregunta_text, chunks)
+    >>> OllamaArgs(prompt=packed.prompt, num_ctx=packed.num_ctx, ...)
+    """
+    def __init__(self,
+                 tokenizer,
+                 system: str,
+                 template: str,
+                 num_predict: int,
+                 max_ctx: int = DEFAULT_MAX_CTX,
+                 buckets: Sequence[int] = NUM_CTX_BUCKETS,
+                 separator: str = '\n',
+                 margin: int = 16):
+        self.tokenizer = tokenizer
+        self.system = system
+        self.template = template
+        self.num_predict = num_predict
+        self.max_ctx = max_ctx
+        self.buckets = [b for b in buckets if b <= max_ctx]
+        self.separator = separator
+        # Algunos tokens de diferencia entre el template de HuggingFace y el de Ollama
+        self.margin = margin
+
+    def render(self, question: str, chunks: Sequence[str]) -> str:
+        return self.template.format(question=question, context=self.separator.join(chunks))
+
+    def prompt_tokens(self, prompt: str, system: str | None = None) -> int:
+        """Largo del prompt con el template de chat del modelo, como lo arma Ollama."""
+        system = self.system if system is None else system
+        messages = [dict(role='system', content=system), dict(role='user', content=prompt)]
+        if getattr(self.tokenizer, 'chat_template', None):
+            return len(self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=True))
+        return len(self.tokenizer(system + prompt)['input_ids'])
+
+    def required_ctx(self, prompt_tokens: int) -> int:
+        return prompt_tokens + self.num_predict + self.margin
+
+    def measure(self, prompt: str, system: str | None = None) -> PackedPrompt:
+        """Mide un prompt ya armado, sin recortarlo."""
+        tokens = self.prompt_tokens(prompt, system)
+        return PackedPrompt(prompt, tokens, num_ctx_for(self.required_ctx(tokens), self.buckets), 1, 1)
+
+    def pack(self, question: str, chunks: Sequence[str]) -> PackedPrompt:
+        chunks = list(chunks)
+        fits = lambda tokens: self.required_ctx(tokens) <= self.max_ctx
+
+        prompt = self.render(question, chunks)
+        tokens = self.prompt_tokens(prompt)
+
+        if not fits(tokens):
+            # Búsqueda binaria de la mayor cantidad de chunks que entra: el largo crece con k
+            low, high = 0, len(chunks) - 1
+            best = None
+            while low <= high:
+                k = (low + high) // 2
+                candidate = self.render(question, chunks[:k])
+                candidate_tokens = self.prompt_tokens(candidate)
+                if fits(candidate_tokens):
+                    best = (k, candidate, candidate_tokens)
+                    low = k + 1
+                else:
+                    high = k - 1
+
+            if best is None:
+                raise ValueError(f"The prompt doesn't fit in {self.max_ctx} tokens even without context")
+
+            k, prompt, tokens = best
+            return PackedPrompt(prompt, tokens, num_ctx_for(self.required_ctx(tokens), self.buckets), k, len(chunks))
+
+        return PackedPrompt(prompt, tokens, num_ctx_for(self.required_ctx(tokens), self.buckets), len(chunks), len(chunks))
+
+    def with_num_ctx(self, args: OllamaArgs) -> OllamaArgs:
+        """Agrega a 'args' el num_ctx que necesita su prompt (que no se recorta)."""
+        packed = self.measure(args['prompt'], args.get('system'))
+        return args | dict(num_ctx=packed.num_ctx)
+
+def sort_by_num_ctx(tasks: list[OllamaArgs]) -> list[OllamaArgs]:
+    """Ordena las tareas por num_ctx, para que cada máquina recargue el modelo lo menos posible."""
+    return sorted(tasks, key=lambda x: x.get('num_ctx') or 0)
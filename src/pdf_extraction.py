@@ -0,0 +1,204 @@
+from __future__ import annotations
+from importlib.metadata import version, PackageNotFoundError
+from importlib.util import find_spec
+from os import makedirs, getpid, replace as replace_file
+from os.path import join as join_paths, exists
+from hashlib import sha256
+from typing import TYPE_CHECKING
+from abc import ABC as AbstractBaseClass, abstractmethod
+import json
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Se incrementa cuando cambia la forma de extraer el texto,
+# para invalidar lo que ya está cacheado.
+EXTRACTOR_VERSION = 1
+
+def file_hash(file_path: str, block_size=1 << 20) -> str:
+    h = sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def package_version(name: str) -> str:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return 'unknown'
+
+class PdfBackend(AbstractBaseClass):
+    """
+    Extractor de texto por página. Cada backend produce un Document por
+    página con metadata {'source', 'page'}, igual que PyPDFLoader, y permite
+    extraer rangos de páginas para poder repartir un PDF entre varios workers.
+    """
+    name: str
+    module: str
+    package: str
+
+    @classmethod
+    def available(cls) -> bool:
+        return find_spec(cls.module) is not None
+
+    @property
+    def extractor_id(self) -> str:
+        return f"{self.name}_{package_version(self.package)}-v{EXTRACTOR_VERSION}"
+
+    @abstractmethod
+    def page_count(self, file_path: str) -> int: ...
+
+    @abstractmethod
+    def extract_pages(self, file_path: str, start: int = 0, stop: int | None = None) -> list[Document]: ...
+
+    def page(self, file_path: str, number: int, text: str) -> Document:
+        from langchain_core.documents import Document
+        return Document(page_content=text, metadata=dict(source=file_path, page=number))
+
+class PypdfBackend(PdfBackend):
+    """Mismo texto que PyPDFLoader (modo 'plain' de pypdf)."""
+    name = 'pypdf'
+    module = 'pypdf'
+    package = 'pypdf'
+
+    def page_count(self, file_path: str) -> int:
+        from pypdf import PdfReader
+        return len(PdfReader(file_path).pages)
+
+    def extract_pages(self, file_path: str, start: int = 0, stop: int | None = None) -> list[Document]:
+        from pypdf import PdfReader
+        pages = PdfReader(file_path).pages
+        stop = len(pages) if stop is None else min(stop, len(pages))
+        return [
+            self.page(file_path, i, pages[i].extract_text(extraction_mode='plain'))
+            for i in range(start, stop)
+        ]
+
+class PymupdfBackend(PdfBackend):
+    name = 'pymupdf'
+    module = 'pymupdf'
+    package = 'pymupdf'
+
+    def page_count(self, file_path: str) -> int:
+        import pymupdf
+        with pymupdf.open(file_path) as pdf:
+            return pdf.page_count
+
+    def extract_pages(self, file_path: str, start: int = 0, stop: int | None = None) -> list[Document]:
+        import pymupdf
+        with pymupdf.open(file_path) as pdf:
+            stop = pdf.page_count if stop is None else min(stop, pdf.page_count)
+            return [self.page(file_path, i, pdf[i].get_text()) for i in range(start, stop)]
+
+class Pypdfium2Backend(PdfBackend):
+    name = 'pypdfium2'
+    module = 'pypdfium2'
+    package = 'pypdfium2'
+
+    def page_count(self, file_path: str) -> int:
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def extract_pages(self, file_path: str, start: int = 0, stop: int | None = None) -> list[Document]:
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(file_path)
+        try:
+            stop = len(pdf) if stop is None else min(stop, len(pdf))
+            return [self.page(file_path, i, pdf[i].get_textpage().get_text_range()) for i in range(start, stop)]
+        finally:
+            pdf.close()
+
+# Ordenados del más rápido al más lento, 'auto' elige el primero instalado.
+# Ojo: cada backend extrae el texto de otra manera (espacios, saltos de línea, orden),
+# así que cambiar de backend cambia los chunks y, como los ids salen del contenido,
+# también sus ids: en modo incremental se reemplazan todos los chunks ya indexados.
+# El default sigue siendo pypdf, con el que se armaron las colecciones existentes.
+PDF_BACKENDS: dict[str, type[PdfBackend]] = {
+    backend.name: backend
+    for backend in (PymupdfBackend, Pypdfium2Backend, PypdfBackend)
+}
+
+DEFAULT_PDF_BACKEND = 'pypdf'
+
+def get_backend(name: str = DEFAULT_PDF_BACKEND) -> PdfBackend:
+    if name == 'auto':
+        name = next(n for n, backend in PDF_BACKENDS.items() if backend.available())
+
+    if name not in PDF_BACKENDS:
+        raise ValueError(f"Invalid PDF backend '{name}'. Expected one of {['auto', *PDF_BACKENDS]}")
+
+    backend = PDF_BACKENDS[name]
+    if not backend.available():
+        raise ValueError(f"PDF backend '{name}' requires the '{backend.package}' package, which is not installed.")
+
+    return backend()
+
+def page_ranges(page_count: int, pages_per_shard: int) -> list[tuple[int, int]]:
+    return [(start, min(start + pages_per_shard, page_count)) for start in range(0, page_count, pages_per_shard)]
+
+class PdfPageCache:
+    """
+    Guarda el texto extraído de cada página de un PDF en un parquet,
+    identificado por el hash del archivo y el extractor usado.
+    Uso:
+    >>> cache = PdfPageCache('./cache/pdf', get_backend('pypdf').extractor_id)
+    >>> pages = cache.load('../docs/ARG_2001-06-18_01-90.pdf', digest)
+    """
+    def __init__(self, folder: str, extractor: str):
+        self.folder = join_paths(folder, extractor)
+        makedirs(self.folder, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return join_paths(self.folder, digest + '.parquet')
+
+    def __contains__(self, digest: str) -> bool:
+        return exists(self.path(digest))
+
+    def load(self, file_path: str, digest: str) -> list[Document] | None:
+        path = self.path(digest)
+        if not exists(path):
+            return None
+
+        import polars
+        from langchain_core.documents import Document
+
+        pages = polars.read_parquet(path)
+        return [
+            Document(page_content=text, metadata=json.loads(metadata) | dict(source=file_path))
+            for text, metadata in pages.select('page_content', 'metadata').iter_rows()
+        ]
+
+    def save(self, digest: str, pages: list[Document]):
+        import polars
+
+        path = self.path(digest)
+        tmp_path = f'{path}.{getpid()}.tmp'
+
+        (polars.DataFrame(dict(
+            page_content = [page.page_content for page in pages],
+            metadata     = [json.dumps(page.metadata) for page in pages]
+        ), schema=dict(page_content=polars.String, metadata=polars.String))
+         .write_parquet(tmp_path))
+
+        replace_file(tmp_path, path)
+
+def load_pdf_pages(file_path: str, backend: str = DEFAULT_PDF_BACKEND, cache_folder: str | None = None) -> list[Document]:
+    extractor = get_backend(backend)
+
+    if cache_folder is None:
+        return extractor.extract_pages(file_path)
+
+    cache = PdfPageCache(cache_folder, extractor.extractor_id)
+    digest = file_hash(file_path)
+
+    pages = cache.load(file_path, digest)
+    if pages is None:
+        pages = extractor.extract_pages(file_path)
+        cache.save(digest, pages)
+
+    return pages
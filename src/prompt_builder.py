@@ -0,0 +1,68 @@
+# Usage:
+# python prompt_builder.py -o ../data/preguntas.parquet
+#
+# Arma el contexto de cada (pregunta, presidente) a partir del dataset de chunks seleccionados
+# (ver context_selection.py): los textos de sus chunks en orden de score, separados por '\n'.
+# Todos los contextos salen de una sola agregación y se escriben en preguntas.parquet
+# (pregunta, pregunta_text, presidente, contexto).
+
+from context_selection import read_dataset, presidencies_frame, DEFAULT_OUTPUT as RELEVANT_CHUNKS
+import polars
+import argparse
+
+def load_chunk_texts(path: str = '../data/arg_embeddings.parquet') -> polars.LazyFrame:
+    """Texto de cada chunk, una fila por vector_id."""
+    return polars.scan_parquet(path).select('vector_id', 'text').unique('vector_id', keep='first')
+
+def load_questions(path: str = '../data/preguntas_clean_arg.csv') -> polars.DataFrame:
+    return polars.read_csv(path)['qid', 'pregunta'].unique(maintain_order=True)
+
+def build_contexts(relevant_chunks: polars.LazyFrame, texts: polars.LazyFrame) -> polars.LazyFrame:
+    """(qid, presidente, contexto), con los textos de cada grupo ordenados por score normalizado descendente."""
+    return (relevant_chunks
+            .select('qid', 'presidente', 'vector_id', 'normalized_score')
+            .join(texts, on='vector_id', how='left')
+            .group_by(['qid', 'presidente'])
+            .agg(contexto=polars.col('text').sort_by('normalized_score', descending=True, maintain_order=True).str.join('\n')))
+
+def build_chunk_lists(relevant_chunks: polars.LazyFrame, texts: polars.LazyFrame) -> polars.DataFrame:
+    """(qid, presidente, chunks): los textos de cada grupo como lista, en orden de score (para packing.py)."""
+    return (relevant_chunks
+            .select('qid', 'presidente', 'vector_id', 'normalized_score')
+            .join(texts, on='vector_id', how='left')
+            .group_by(['qid', 'presidente'])
+            .agg(chunks=polars.col('text').sort_by('normalized_score', descending=True, maintain_order=True))
+            .collect())
+
+def build_prompts(relevant_chunks: polars.LazyFrame,
+                  texts: polars.LazyFrame,
+                  questions: polars.DataFrame,
+                  presidents: list[str]) -> polars.DataFrame:
+    """
+    Una fila por cada (pregunta, presidente), en el orden de las preguntas y luego de los
+    presidentes. Las combinaciones sin chunks seleccionados quedan con el contexto vacío.
+    """
+    pairs = (questions.lazy()
+             .rename(dict(qid='pregunta', pregunta='pregunta_text'))
+             .join(polars.LazyFrame(dict(presidente=presidents)), how='cross'))
+
+    return (pairs
+            .join(build_contexts(relevant_chunks, texts), left_on=['pregunta', 'presidente'], right_on=['qid', 'presidente'], how='left')
+            .with_columns(polars.col('contexto').fill_null(''))
+            .select('pregunta', 'pregunta_text', 'presidente', 'contexto')
+            .collect())
+
+def main(relevant_chunks: str, embeddings: str, questions: str, presidencies: str, output: str):
+    presidents = presidencies_frame(presidencies)['presidente'].unique(maintain_order=True).to_list()
+    prompts = build_prompts(read_dataset(relevant_chunks), load_chunk_texts(embeddings), load_questions(questions), presidents)
+    prompts.write_parquet(output)
+    print(f"{len(prompts)} prompts written to {output}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--relevant-chunks', type=str, default=RELEVANT_CHUNKS, help='Partitioned dataset written by context_selection.py')
+    parser.add_argument('--embeddings', type=str, default='../data/arg_embeddings.parquet', help='Parquet with the vector_id and text of each chunk')
+    parser.add_argument('--questions', type=str, default='../data/preguntas_clean_arg.csv')
+    parser.add_argument('--presidencies', type=str, default='../data/docs_por_presidencia.json')
+    parser.add_argument('-o','--output', type=str, default='../data/preguntas.parquet')
+    main(**vars(parser.parse_args()))
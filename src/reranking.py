@@ -0,0 +1,443 @@
+import numpy
+import polars
+import pyarrow
+import pyarrow.parquet
+from hashlib import blake2b
+from glob import glob
+from os import makedirs, getpid, replace, remove, cpu_count
+from os.path import join as join_paths, exists
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from dataclasses import dataclass, field
+from time import time_ns
+from context_selection import file_name, presidencies_frame, within_budget, DEFAULT_MAX_TOKENS
+import shutil
+
+RERANKER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+DEFAULT_CACHE_FOLDER = './cache/reranker'
+
+def model_slug(model_name: str) -> str:
+    return model_name.replace('/', '__')
+
+def pair_key(question: str, text: str) -> bytes:
+    h = blake2b(digest_size=16)
+    h.update(question.encode('utf-8'))
+    h.update(b'\x1f')
+    h.update(text.encode('utf-8'))
+    return h.digest()
+
+class ScoreCache:
+    """
+    Cache persistente de los scores de un reranker, por hash de (pregunta, texto del chunk).
+
+    Cada modelo (y backend, porque los scores de 'onnx-int8' no son idénticos a los de
+    'torch') tiene su carpeta, con un parquet (key, score) por cada vez que se guardaron
+    scores nuevos; al abrirla se leen todos.
+    Uso:
+    >>> cache = ScoreCache('./cache/reranker', 'cross-encoder/ms-marco-MiniLM-L-6-v2-torch')
+    >>> scores, missing = cache.get_many(pairs)
+    """
+    def __init__(self, folder: str, model_name: str):
+        self.folder = join_paths(folder, model_slug(model_name))
+        self.model_name = model_name
+        self.scores: dict[bytes, float] = {}
+        self.pending: dict[bytes, float] = {}
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def load(self):
+        for path in sorted(glob(join_paths(self.folder, 'part-*.parquet'))):
+            table = pyarrow.parquet.read_table(path)
+            self.scores.update(zip(table['key'].to_pylist(), table['score'].to_pylist()))
+
+    def get_many(self, pairs: Sequence[tuple[str, str]]) -> tuple[numpy.ndarray, list[int]]:
+        """Devuelve los scores (NaN donde no hay) y las posiciones de los pares que faltan."""
+        scores = numpy.full((len(pairs),), numpy.nan, dtype=numpy.float32)
+        missing = []
+
+        for i, (question, text) in enumerate(pairs):
+            score = self.scores.get(pair_key(question, text))
+            if score is None:
+                missing.append(i)
+            else:
+                scores[i] = score
+
+        return scores, missing
+
+    def put_many(self, pairs: Sequence[tuple[str, str]], scores: Sequence[float]):
+        for (question, text), score in zip(pairs, scores):
+            key = pair_key(question, text)
+            self.scores[key] = float(score)
+            self.pending[key] = float(score)
+
+    def save(self):
+        """Escribe los scores nuevos en un parquet más de la carpeta del modelo."""
+        if not self.pending:
+            return
+
+        makedirs(self.folder, exist_ok=True)
+        path = join_paths(self.folder, f'part-{time_ns()}-{getpid()}.parquet')
+        table = pyarrow.table(dict(
+            key = pyarrow.array(list(self.pending), pyarrow.binary(16)),
+            score = pyarrow.array(list(self.pending.values()), pyarrow.float32())
+        ))
+        pyarrow.parquet.write_table(table, path + '.tmp')
+        replace(path + '.tmp', path)
+        self.pending.clear()
+
+    def compact(self):
+        """Junta todas las partes en una sola."""
+        parts = glob(join_paths(self.folder, 'part-*.parquet'))
+        self.pending = dict(self.scores)
+        self.save()
+        for path in parts:
+            remove(path)
+
+    def invalidate(self):
+        """Borra todos los scores de este modelo, en memoria y en disco."""
+        self.scores.clear()
+        self.pending.clear()
+        if exists(self.folder):
+            shutil.rmtree(self.folder)
+
+def invalidate(folder: str, model_name: str | None = None):
+    """Borra los scores cacheados de 'model_name' (todas sus variantes de backend), o de todos los modelos si es None."""
+    if model_name is None:
+        paths = [folder]
+    else:
+        slug = model_slug(model_name)
+        paths = [join_paths(folder, slug), *glob(join_paths(folder, slug + '-*'))]
+
+    for path in paths:
+        if exists(path):
+            shutil.rmtree(path)
+
+class CachedReranker:
+    """
+    Envoltorio de un CrossEncoder que consulta el cache antes de
+    predecir, y solo le pasa al modelo los pares faltantes.
+    El resto de los atributos se delegan en el modelo.
+    """
+    def __init__(self, model, cache: ScoreCache):
+        self.model = model
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def predict(self, sentences: Sequence[tuple[str, str]], **kwargs) -> numpy.ndarray:
+        sentences = [tuple(x) for x in sentences]
+        scores, missing = self.cache.get_many(sentences)
+
+        self.hits += len(sentences) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            unique_missing = list(dict.fromkeys(sentences[i] for i in missing))
+            predicted = numpy.asarray(self.model.predict(unique_missing, **kwargs), dtype=numpy.float32)
+
+            by_pair = dict(zip(unique_missing, predicted))
+            for i in missing:
+                scores[i] = by_pair[sentences[i]]
+
+            self.cache.put_many(unique_missing, predicted)
+
+        return scores
+
+    def save(self):
+        self.cache.save()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0
+        return f"Reranker cache: {self.hits} hits, {self.misses} misses ({ratio:.1%} hit ratio), {len(self.cache)} cached scores."
+
+# Reranking en varios procesos: los pares se parten en shards de tamaño fijo (independiente de la
+# cantidad de procesos) y dentro de cada shard se ordenan por largo en tokens, para que cada batch
+# tenga poco padding. Como los batches son los mismos con 1 o con N procesos, los scores también.
+
+_worker_model = None
+
+def _init_worker(model_name: str, backend: str, threads: int | None):
+    global _worker_model
+    from inference_backends import load_reranker
+
+    # Cuando corre el initializer numpy/torch ya están importados y OMP_NUM_THREADS no tiene
+    # efecto: los hilos se fijan en el modelo (torch.set_num_threads o la sesión de onnxruntime)
+    _worker_model = load_reranker(model_name, backend=backend, device='cpu', threads=threads)
+
+def _score_shard_in_worker(args: tuple[int, list[tuple[str, str]], int, bool]) -> tuple[int, numpy.ndarray]:
+    shard, pairs, batch_size, sort_by_length = args
+    return shard, predict_shard(_worker_model, pairs, batch_size, sort_by_length)
+
+def token_lengths(tokenizer, pairs: Sequence[tuple[str, str]]) -> numpy.ndarray:
+    first, second = zip(*pairs)
+    encoded = tokenizer(list(first), list(second), truncation='longest_first', max_length=tokenizer.model_max_length)
+    return numpy.fromiter(map(len, encoded['input_ids']), dtype=numpy.int64, count=len(pairs))
+
+def length_sorted_predict(model, pairs: Sequence[tuple[str, str]], batch_size: int) -> numpy.ndarray:
+    """model.predict con los pares ordenados de más largo a más corto, devuelto en el orden original."""
+    if not pairs:
+        return numpy.zeros((0,), dtype=numpy.float32)
+
+    order = numpy.argsort(-token_lengths(model.tokenizer, pairs), kind='stable')
+    sorted_scores = model.predict([pairs[i] for i in order], batch_size=batch_size, show_progress_bar=False)
+
+    scores = numpy.empty((len(pairs),), dtype=numpy.float32)
+    scores[order] = sorted_scores
+    return scores
+
+def predict_shard(model, pairs: Sequence[tuple[str, str]], batch_size: int, sort_by_length: bool) -> numpy.ndarray:
+    if sort_by_length:
+        return length_sorted_predict(model, pairs, batch_size)
+    if not pairs:
+        return numpy.zeros((0,), dtype=numpy.float32)
+    return numpy.asarray(model.predict(list(pairs), batch_size=batch_size, show_progress_bar=False), dtype=numpy.float32)
+
+class ShardedReranker:
+    """
+    CrossEncoder para CPU repartido en un pool de procesos, con la interfaz de 'predict'.
+    Cada proceso carga el modelo una sola vez (en el initializer del pool).
+    Los shards se cortan en múltiplos de 'batch_size', así que los scores no cambian con la
+    cantidad de procesos. Con sort_by_length (el default) cada shard se predice ordenado por
+    largo, con menos padding, y los scores se devuelven en el orden original; como los batches
+    cambian, pueden diferir en el orden de 1e-6 de los de CrossEncoder.predict. Con
+    sort_by_length=False cada batch tiene los mismos pares que en CrossEncoder.predict.
+    Uso:
+    >>> with ShardedReranker(RERANKER_MODEL, backend='onnx-int8', processes=8) as reranker:
+    ...     scores = reranker.predict(pairs, batch_size=100)
+    """
+    def __init__(self,
+                 model_name: str = RERANKER_MODEL,
+                 backend: str = 'torch',
+                 processes: int | None = None,
+                 shard_size: int = 4096,
+                 threads_per_process: int | None = None,
+                 sort_by_length: bool = True):
+        from inference_backends import load_reranker
+
+        self.model_name = model_name
+        self.backend = backend
+        self.processes = processes or cpu_count()
+        self.shard_size = shard_size
+        self.sort_by_length = sort_by_length
+        self.model = None
+        self.executor = None
+
+        if self.processes == 1:
+            self.model = load_reranker(model_name, backend=backend, device='cpu')
+        else:
+            threads = threads_per_process or max(1, cpu_count() // self.processes)
+            self.executor = ProcessPoolExecutor(self.processes,
+                                                mp_context=get_context('spawn'),
+                                                initializer=_init_worker,
+                                                initargs=(model_name, backend, threads))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def predict(self,
+                sentences: Sequence[tuple[str, str]],
+                batch_size: int = 32,
+                show_progress_bar: bool | None = None,
+                **kwargs) -> numpy.ndarray:
+        from tqdm.auto import tqdm
+
+        sentences = [tuple(x) for x in sentences]
+        shard_size = max(batch_size, self.shard_size // batch_size * batch_size)
+        shards = [(i, sentences[start:start + shard_size], batch_size, self.sort_by_length)
+                  for i, start in enumerate(range(0, len(sentences), shard_size))]
+
+        if self.executor is None:
+            results = ((i, predict_shard(self.model, pairs, batch_size, self.sort_by_length)) for i, pairs, *_ in shards)
+        else:
+            results = self.executor.map(_score_shard_in_worker, shards)
+
+        scores = numpy.empty((len(sentences),), dtype=numpy.float32)
+        for i, shard_scores in tqdm(results, total=len(shards), disable=not show_progress_bar):
+            scores[i * shard_size:i * shard_size + len(shard_scores)] = shard_scores
+
+        return scores
+
+def load_cached_reranker(model_name: str = RERANKER_MODEL,
+                         backend: str = 'torch',
+                         device: str = 'cpu',
+                         cache_folder: str = DEFAULT_CACHE_FOLDER,
+                         processes: int | None = None,
+                         sort_by_length: bool = True) -> CachedReranker:
+    """
+    Con 'processes' (sólo en CPU) el modelo es un ShardedReranker con ese pool de procesos,
+    que predice los pares ordenados por largo salvo que sort_by_length sea False.
+    """
+    if processes:
+        if device != 'cpu':
+            raise ValueError("Multi-process reranking only runs on 'cpu'")
+        model = ShardedReranker(model_name, backend=backend, processes=processes, sort_by_length=sort_by_length)
+    else:
+        from inference_backends import load_reranker
+        model = load_reranker(model_name, backend=backend, device=device)
+
+    return CachedReranker(model, ScoreCache(cache_folder, f'{model_name}-{backend}'))
+
+# =======================================================================================================================
+# Reranking en cascada: sólo se cross-encodean los candidatos necesarios para llenar el presupuesto de
+# tokens de cada presidente (el mismo corte que hace get_prompts.ipynb), en orden de distancia del bi-encoder.
+
+def chunk_presidencies(embeddings_path: str = '../data/arg_embeddings.parquet',
+                       presidencies_path: str = '../data/docs_por_presidencia.json') -> polars.DataFrame:
+    """(vector_id, presidente) de cada chunk, a partir de su 'source' y docs_por_presidencia.json."""
+    return (polars.scan_parquet(embeddings_path)
+            .select('vector_id', file_name(polars.col('source')).alias('file'))
+            .join(presidencies_frame(presidencies_path).lazy(), on='file')
+            .select('vector_id', 'presidente')
+            .collect())
+
+def load_candidates(path: str, token_counts: polars.DataFrame, presidencies: polars.DataFrame | None = None) -> polars.DataFrame:
+    """
+    Candidatos de una pregunta (vector_id, text, distance, presidente, token_count) a partir de su
+    '{qid}_embeddings.parquet'. Si el archivo no tiene 'presidente' se toma de 'presidencies'.
+    Los chunks sin presidente se descartan, como en get_prompts.ipynb.
+    """
+    candidates = polars.read_parquet(path).drop('vector', strict=False)
+    if 'presidente' not in candidates.columns:
+        candidates = candidates.join(presidencies, on='vector_id')
+
+    return (candidates
+            .join(token_counts.select('vector_id', 'token_count'), on='vector_id', how='left')
+            .filter(polars.col('presidente').is_not_null())
+            .select('vector_id', 'text', 'distance', 'presidente', 'token_count'))
+
+def select_within_budget(scored: polars.DataFrame, max_tokens: int = DEFAULT_MAX_TOKENS, by: str | list[str] = 'presidente') -> polars.DataFrame:
+    """Los chunks de mayor score de cada grupo cuya suma de 'token_count' no supera 'max_tokens'."""
+    cumsum, budget = within_budget(max_tokens, by)
+    return (scored
+            .sort('score', descending=True, maintain_order=True)
+            .with_columns(cumsum)
+            .filter(budget))
+
+@dataclass(eq=False)
+class CascadePartition:
+    """Candidatos de un presidente ordenados por distancia, y cuántos se cross-encodearon."""
+    presidente: str
+    vector_ids: list[str]
+    texts: list[str]
+    token_counts: numpy.ndarray
+    scores: numpy.ndarray
+    scored: int = 0
+    stable_steps: int = 0
+    selected: frozenset = frozenset()
+    done: bool = False
+
+    def selection(self, max_tokens: int) -> tuple[frozenset, bool]:
+        """Posiciones de los chunks que entran en el presupuesto y si el presupuesto ya está lleno."""
+        order = numpy.argsort(-self.scores[:self.scored], kind='stable')
+        cumsum = numpy.cumsum(self.token_counts[:self.scored][order])
+        return frozenset(order[cumsum <= max_tokens].tolist()), bool(len(cumsum) and cumsum[-1] > max_tokens)
+
+    def update(self, max_tokens: int, margin: float, patience: int):
+        selected, is_full = self.selection(max_tokens)
+        self.stable_steps = self.stable_steps + 1 if selected == self.selected else 0
+        self.selected = selected
+
+        # El chunk seleccionado más lejano según el bi-encoder: se sigue cross-encodeando
+        # al menos 'margin' veces esa profundidad más allá de él.
+        deepest = max(selected) + 1 if selected else 0
+
+        self.done = (self.scored == len(self.vector_ids)
+                     or (is_full and self.stable_steps >= patience and self.scored >= deepest * (1 + margin)))
+
+@dataclass
+class CascadeStats:
+    candidates: int = 0
+    scored: int = 0
+    depth: dict[str, int] = field(default_factory=dict)
+
+    def __str__(self):
+        ratio = self.scored / self.candidates if self.candidates else 0
+        return f"Cascade: cross-encoded {self.scored} of {self.candidates} candidates ({ratio:.1%})."
+
+def cascade_rerank(model,
+                   question: str,
+                   candidates: polars.DataFrame,
+                   max_tokens: int = DEFAULT_MAX_TOKENS,
+                   batch_size: int = 64,
+                   margin: float = .5,
+                   patience: int = 2,
+                   **predict_kwargs) -> tuple[polars.DataFrame, CascadeStats]:
+    """
+    Cross-encodea los candidatos de cada presidente en orden de distancia, de a 'batch_size'
+    por presidente (todos los presidentes activos van en una misma llamada al modelo), y deja
+    de hacerlo para un presidente cuando:
+      - su presupuesto de tokens ya está lleno,
+      - la selección no cambió en las últimas 'patience' tandas, y
+      - se cross-encodearon al menos (1 + margin) veces tantos candidatos como la posición
+        (por distancia) del chunk seleccionado más lejano.
+    Devuelve sólo los candidatos cross-encodeados (vector_id, presidente, token_count, distance, score).
+    """
+    partitions = [
+        CascadePartition(presidente=presidente,
+                         vector_ids=group['vector_id'].to_list(),
+                         texts=group['text'].to_list(),
+                         token_counts=group['token_count'].fill_null(0).to_numpy(),
+                         scores=numpy.full((len(group),), numpy.nan, dtype=numpy.float32))
+        for (presidente,), group in candidates.sort('distance', maintain_order=True).group_by('presidente', maintain_order=True)
+    ]
+    stats = CascadeStats(candidates=len(candidates))
+
+    while active := [p for p in partitions if not p.done]:
+        steps = [(p, p.scored, min(p.scored + batch_size, len(p.vector_ids))) for p in active]
+        pairs = [(question, p.texts[i]) for p, start, stop in steps for i in range(start, stop)]
+        scores = numpy.asarray(model.predict(pairs, batch_size=batch_size, **predict_kwargs), dtype=numpy.float32)
+
+        offset = 0
+        for p, start, stop in steps:
+            p.scores[start:stop] = scores[offset:offset + stop - start]
+            offset += stop - start
+            p.scored = stop
+            p.update(max_tokens, margin, patience)
+
+    stats.scored = sum(p.scored for p in partitions)
+    stats.depth = {p.presidente: p.scored for p in partitions}
+
+    scored = candidates.join(
+        polars.DataFrame(dict(
+            vector_id=[x for p in partitions for x in p.vector_ids[:p.scored]],
+            score=numpy.concatenate([p.scores[:p.scored] for p in partitions]) if partitions else numpy.zeros((0,), dtype=numpy.float32),
+        )),
+        on='vector_id'
+    ).select('vector_id', 'presidente', 'token_count', 'distance', 'score')
+
+    return scored, stats
+
+def verify_cascade(full: polars.DataFrame, cascade: polars.DataFrame, max_tokens: int = DEFAULT_MAX_TOKENS) -> polars.DataFrame:
+    """
+    Compara los chunks seleccionados por presidente con el reranking completo y en cascada.
+    Ambos DataFrames necesitan vector_id, presidente, token_count y score.
+    """
+    def selected(scored: polars.DataFrame, name: str) -> polars.DataFrame:
+        return (select_within_budget(scored, max_tokens)
+                .group_by('presidente', maintain_order=True)
+                .agg(polars.col('vector_id').alias(name)))
+
+    return (selected(full, 'full')
+            .join(selected(cascade, 'cascade'), on='presidente', how='full', coalesce=True)
+            .with_columns(
+                missing = polars.col('full').list.set_difference('cascade').list.len(),
+                extra = polars.col('cascade').list.set_difference('full').list.len(),
+                full_scored = polars.col('presidente').replace_strict(dict(full.group_by('presidente').len().rows()), default=0),
+                cascade_scored = polars.col('presidente').replace_strict(dict(cascade.group_by('presidente').len().rows()), default=0))
+            .with_columns(identical = (polars.col('missing') == 0) & (polars.col('extra') == 0))
+            .select('presidente', 'identical', 'missing', 'extra', 'full_scored', 'cascade_scored'))
@@ -0,0 +1,219 @@
+# Usage:
+# python retrieval.py -s ../data/arg_store -q ../data/preguntas_clean_arg.csv -o ../data
+#
+# Búsqueda exacta de los vecinos más cercanos de todas las preguntas a la vez,
+# sobre un EmbeddingStore (ver utils.py), en lugar de una consulta a Chroma por pregunta.
+# Escribe un '{qid}_embeddings.parquet' por pregunta, con el mismo formato que extract_knn.ipynb.
+#
+# Si los chunks tienen 'presidente' (ver vectorize_documents.py), la búsqueda se hace dentro
+# de cada presidencia por separado y en paralelo: cada una se queda con su fracción de chunks
+# y el resultado tiene la columna 'presidente'. Con '--no-partitions' se busca en todo el corpus.
+
+from utils import EmbeddingStore, TaggedVectorBatch
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join as join_paths
+from time import perf_counter
+import numpy
+import polars
+import pyarrow
+import argparse
+import sys
+import os
+
+EMBEDDING_MODEL = 'sentence-transformers/all-mpnet-base-v2'
+SPACES = ['cosine', 'ip', 'l2']
+DEFAULT_BLOCK_SIZE = 16_384
+DEFAULT_FRACTION = .65
+PARTITION_COLUMN = 'presidente'
+
+def debug_print(message: str, verbose: bool = True):
+    if verbose:
+        print(message, file=sys.stderr)
+
+def normalize(matrix: numpy.ndarray) -> numpy.ndarray:
+    norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / numpy.maximum(norms, numpy.finfo(numpy.float32).tiny)
+
+def block_distances(queries: numpy.ndarray, block: numpy.ndarray, space: str) -> numpy.ndarray:
+    """
+    Distancias (Q, B) entre las preguntas y un bloque de vectores, con la misma
+    definición que usa Chroma para cada 'hnsw:space'. Para 'cosine' las preguntas
+    tienen que venir normalizadas.
+    """
+    match space:
+        case 'cosine':
+            return 1 - queries @ normalize(block).T
+        case 'ip':
+            return 1 - queries @ block.T
+        case 'l2':
+            return (numpy.sum(queries ** 2, axis=1, keepdims=True)
+                    + numpy.sum(block ** 2, axis=1)
+                    - 2 * queries @ block.T)
+        case _:
+            raise ValueError(f"Invalid space '{space}'. Expected one of {SPACES}")
+
+def knn(queries: numpy.ndarray,
+        vectors: numpy.ndarray,
+        k: int,
+        space: str = 'cosine',
+        block_size: int = DEFAULT_BLOCK_SIZE) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Los k vecinos exactos de cada pregunta. Recorre 'vectors' (que puede ser un memmap)
+    en bloques de 'block_size' filas y en cada paso se queda sólo con los k mejores
+    candidatos, así que la memoria usada es O(Q * (k + block_size)).
+    Devuelve (filas, distancias), ambas (Q, k), ordenadas de la más cercana a la más lejana.
+    """
+    queries = numpy.asarray(queries, dtype=numpy.float32)
+    if space == 'cosine':
+        queries = normalize(queries)
+
+    k = min(k, len(vectors))
+    best_distances = numpy.empty((len(queries), 0), dtype=numpy.float32)
+    best_rows = numpy.empty((len(queries), 0), dtype=numpy.int64)
+
+    for start in range(0, len(vectors), block_size):
+        block = numpy.asarray(vectors[start:start + block_size], dtype=numpy.float32)
+        distances = numpy.concatenate([best_distances, block_distances(queries, block, space)], axis=1)
+        rows = numpy.concatenate([best_rows, numpy.broadcast_to(numpy.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+
+        if distances.shape[1] > k:
+            keep = numpy.argpartition(distances, k - 1, axis=1)[:, :k]
+            distances = numpy.take_along_axis(distances, keep, axis=1)
+            rows = numpy.take_along_axis(rows, keep, axis=1)
+
+        best_distances, best_rows = distances, rows
+
+    order = numpy.argsort(best_distances, axis=1, kind='stable')
+    return numpy.take_along_axis(best_rows, order, axis=1), numpy.take_along_axis(best_distances, order, axis=1)
+
+def load_questions(path: str) -> polars.DataFrame:
+    return polars.read_csv(path)['qid', 'pregunta'].unique(maintain_order=True)
+
+def encode_questions(questions: list[str], device: str = 'cpu', backend: str = 'torch') -> numpy.ndarray:
+    from inference_backends import load_embedding_model
+    model = load_embedding_model(EMBEDDING_MODEL, backend, device)
+    return numpy.asarray(model.encode(questions), dtype=numpy.float32)
+
+def batch_for_rows(store: EmbeddingStore, qid: str, rows: numpy.ndarray, distances: numpy.ndarray, extra: dict | None = None) -> TaggedVectorBatch:
+    return TaggedVectorBatch(
+        vector_ids = store.id_array.take(rows),
+        texts = store.text_array.take(rows),
+        distances = distances.astype(numpy.float64),
+        vectors = store.take(rows),
+        distance_to = qid,
+        extra = extra or {}
+    )
+
+def rankings(store: EmbeddingStore,
+             qids: list[str],
+             query_embeddings: numpy.ndarray,
+             k: int,
+             space: str = 'cosine',
+             block_size: int = DEFAULT_BLOCK_SIZE):
+    """Genera (qid, TaggedVectorBatch) con los k vecinos de cada pregunta, del más cercano al más lejano."""
+    rows, distances = knn(query_embeddings, store.vectors, k, space, block_size)
+
+    for qid, question_rows, question_distances in zip(qids, rows, distances):
+        yield qid, batch_for_rows(store, qid, question_rows, question_distances)
+
+def partitions(store: EmbeddingStore, column: str = PARTITION_COLUMN) -> dict[str, numpy.ndarray]:
+    """Filas del store de cada valor de 'column'. Las filas sin valor no pertenecen a ninguna partición."""
+    groups = (store.metadata
+              .select(column)
+              .with_row_index('row')
+              .filter(polars.col(column).is_not_null())
+              .group_by(column, maintain_order=True)
+              .agg('row'))
+    return {partition: numpy.asarray(rows, dtype=numpy.int64) for partition, rows in groups.iter_rows()}
+
+def partitioned_rankings(store: EmbeddingStore,
+                         qids: list[str],
+                         query_embeddings: numpy.ndarray,
+                         fraction: float,
+                         top_k: int | None = None,
+                         space: str = 'cosine',
+                         block_size: int = DEFAULT_BLOCK_SIZE,
+                         column: str = PARTITION_COLUMN,
+                         workers: int | None = None):
+    """
+    Como 'rankings', pero buscando dentro de cada partición: cada una se queda con
+    'top_k' (o la fracción 'fraction') de sus propios chunks. Las particiones se procesan
+    en paralelo (el producto de matrices de numpy libera el GIL) y el resultado de cada
+    pregunta tiene una columna con la partición de cada chunk.
+    """
+    def rank(item: tuple[str, numpy.ndarray]):
+        partition, rows = item
+        k = top_k or int(round(len(rows) * fraction))
+        partition_rows, distances = knn(query_embeddings, store.take(rows), k, space, block_size)
+        return partition, rows[partition_rows], distances
+
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(rank, partitions(store, column).items()))
+
+    for i, qid in enumerate(qids):
+        rows = numpy.concatenate([rows[i] for _, rows, _ in results])
+        distances = numpy.concatenate([distances[i] for _, _, distances in results])
+        labels = pyarrow.array([partition for partition, rows, _ in results for _ in range(rows.shape[1])], pyarrow.string())
+        yield qid, batch_for_rows(store, qid, rows, distances, extra={column: labels})
+
+def main(store_folder: str,
+         questions_path: str,
+         output_folder: str,
+         fraction: float,
+         top_k: int | None,
+         space: str,
+         block_size: int,
+         device: str,
+         backend: str,
+         no_partitions: bool,
+         workers: int | None,
+         verbose: bool):
+    store = EmbeddingStore.open(store_folder)
+    questions = load_questions(questions_path)
+    partitioned = not no_partitions and PARTITION_COLUMN in store.metadata.columns
+    k = top_k or int(round(len(store) * fraction))
+    debug_print(f"{len(questions)} questions, {len(store)} chunks, " + (f"partitioned by '{PARTITION_COLUMN}'" if partitioned else f"k = {k}"), verbose)
+
+    start = perf_counter()
+    query_embeddings = encode_questions(questions['pregunta'].to_list(), device, backend)
+    debug_print(f"Encoded questions in {perf_counter() - start:.2f} s", verbose)
+
+    start = perf_counter()
+    os.makedirs(output_folder, exist_ok=True)
+    qids = questions['qid'].to_list()
+    if partitioned:
+        results = partitioned_rankings(store, qids, query_embeddings, fraction, top_k, space, block_size, workers=workers)
+    else:
+        results = rankings(store, qids, query_embeddings, k, space, block_size)
+
+    for qid, batch in results:
+        # Mismo orden que extract_knn.ipynb: de la distancia más grande a la más chica
+        batch.sorted_by_distance(descending=True).write_parquet(join_paths(output_folder, f'{qid}_embeddings.parquet'))
+    debug_print(f"Ranked and wrote {len(questions)} questions in {perf_counter() - start:.2f} s", verbose)
+
+class Parser(argparse.ArgumentParser):
+    def __init__(self):
+        super(Parser, self).__init__()
+        self.add_argument('-s','--store', type=str, default='../data/arg_store', help='Folder of the EmbeddingStore to search')
+        self.add_argument('-q','--questions', type=str, default='../data/preguntas_clean_arg.csv', help='CSV with the questions (qid, pregunta)')
+        self.add_argument('-o','--output', type=str, default='../data', help='Folder for the {qid}_embeddings.parquet files')
+        self.add_argument('-f','--fraction', type=float, default=DEFAULT_FRACTION, help='Fraction of the chunks to keep per question')
+        self.add_argument('-k','--top-k', type=int, default=None, help='Number of chunks to keep per question and partition (overrides --fraction)')
+        self.add_argument('--space', type=str, default='cosine', choices=SPACES, help="Distance, as in the collection's 'hnsw:space'")
+        self.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE, help='Chunks scored per matrix product (bounds the memory used)')
+        self.add_argument('--no-partitions', action='store_true', help=f"Rank the whole corpus even if the chunks have '{PARTITION_COLUMN}'")
+        self.add_argument('-w','--workers', type=int, default=None, help='Threads ranking partitions in parallel')
+        self.add_argument('-d','--device', type=str, default='cpu', help='Device for the embedding model')
+        self.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx', 'onnx-int8'], help='Inference backend for the embedding model')
+        self.add_argument('-v','--verbose', action='store_true', help='Prints more information')
+
+    def parse_args(self):
+        self.args = super(Parser, self).parse_args().__dict__
+        self.args['store_folder'] = self.args.pop('store')
+        self.args['questions_path'] = self.args.pop('questions')
+        self.args['output_folder'] = self.args.pop('output')
+        return self.args
+
+if __name__ == '__main__':
+    parser = Parser()
+    main(**parser.parse_args())
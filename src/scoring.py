@@ -0,0 +1,112 @@
+import polars
+import pyarrow.parquet
+from glob import glob
+from collections.abc import Iterable
+import json
+
+EXTREMES_PATH = '../data/normalizer_absolute_extremes.json'
+RELEVANCE_SUFFIX = '_relevance_scores.parquet'
+NORMALIZED_SUFFIX = '_normalized_score.parquet'
+
+def map_value(value: polars.Expr, istart: float, istop: float, ostart: float = 0, ostop: float = 1) -> polars.Expr:
+    """La misma transformación lineal que fundar.utils.map_value, como expresión de polars."""
+    return ostart + (ostop - ostart) * ((value - istart) / (istop - istart))
+
+def normalized_score(minimum: float, maximum: float, column: str = 'score') -> polars.Expr:
+    return map_value(polars.col(column).cast(polars.Float64), minimum, maximum).alias('normalized_score')
+
+def normalized_path(path: str) -> str:
+    """'../data/q0_relevance_scores.parquet' -> '../data/q0_normalized_score.parquet'"""
+    if not path.endswith(RELEVANCE_SUFFIX):
+        raise ValueError(f"Expected a '*{RELEVANCE_SUFFIX}' file, got '{path}'")
+    return path.removesuffix(RELEVANCE_SUFFIX) + NORMALIZED_SUFFIX
+
+class ExtremesTracker:
+    """
+    Mínimo y máximo de los scores vistos hasta ahora, para ir actualizándolos
+    mientras se calculan los scores en lugar de volver a leer los archivos.
+    """
+    def __init__(self):
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+
+    def update(self, scores) -> 'ExtremesTracker':
+        scores = polars.Series(scores)
+        if len(scores):
+            self.minimum = min(self.minimum, float(scores.min()))
+            self.maximum = max(self.maximum, float(scores.max()))
+        return self
+
+    @property
+    def extremes(self) -> tuple[float, float]:
+        return self.minimum, self.maximum
+
+    def as_dict(self) -> dict[str, float]:
+        return dict(absolute_max=self.maximum, absolute_min=self.minimum)
+
+    def save(self, path: str = EXTREMES_PATH):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f)
+
+def load_extremes(path: str = EXTREMES_PATH) -> tuple[float, float]:
+    with open(path, encoding='utf-8') as f:
+        extremes = json.load(f)
+    return extremes['absolute_min'], extremes['absolute_max']
+
+def extremes_from_statistics(paths: Iterable[str], column: str = 'score') -> tuple[float, float] | None:
+    """
+    Mínimo y máximo de 'column' a partir de las estadísticas de los row groups de cada
+    parquet, sin leer los datos. Devuelve None si a algún row group le faltan estadísticas.
+    """
+    minimum, maximum = float('inf'), float('-inf')
+
+    for path in paths:
+        metadata = pyarrow.parquet.read_metadata(path)
+        index = metadata.schema.to_arrow_schema().get_field_index(column)
+
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            if row_group.num_rows == 0:
+                continue
+            statistics = row_group.column(index).statistics
+            if statistics is None or not statistics.has_min_max:
+                return None
+            minimum = min(minimum, float(statistics.min))
+            maximum = max(maximum, float(statistics.max))
+
+    return minimum, maximum
+
+def score_extremes(paths: list[str], column: str = 'score') -> tuple[float, float]:
+    """Mínimo y máximo global de 'column': de las estadísticas de los parquet o, si no están, con una pasada lazy."""
+    extremes = extremes_from_statistics(paths, column)
+    if extremes is not None:
+        return extremes
+
+    row = (polars.scan_parquet(paths)
+           .select(polars.col(column).min().alias('min'), polars.col(column).max().alias('max'))
+           .collect(streaming=True)
+           .row(0))
+    return float(row[0]), float(row[1])
+
+def normalize_scores(paths: list[str] | str = '../data/q?_relevance_scores.parquet',
+                     extremes: tuple[float, float] | None = None) -> list[str]:
+    """
+    Escribe '{qid}_normalized_score.parquet' (vector_id, score_to, normalized_score) por cada
+    archivo de scores, llevando los scores a [0, 1] con los extremos globales. Si no se pasan
+    'extremes' se calculan de los mismos archivos. Devuelve las rutas escritas.
+    """
+    if isinstance(paths, str):
+        paths = sorted(glob(paths))
+
+    minimum, maximum = extremes or score_extremes(paths)
+    written = []
+
+    for path in paths:
+        output = normalized_path(path)
+        (polars.scan_parquet(path)
+            .with_columns(normalized_score(minimum, maximum))
+            .drop('score')
+            .sink_parquet(output))
+        written.append(output)
+
+    return written
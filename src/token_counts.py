@@ -0,0 +1,183 @@
+# Usage:
+# python token_counts.py --tokenizer llama3.2 -i ../data/arg_embeddings.parquet -o ../data/arg_token_counts.parquet
+#
+# Cuenta los tokens de cada chunk con el tokenizer rápido de HuggingFace, en batches grandes
+# repartidos en un pool de procesos. Los conteos se guardan por (tokenizer, hash del texto),
+# así que los textos repetidos y las corridas siguientes no vuelven a tokenizar nada.
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from collections.abc import Sequence
+from hashlib import blake2b
+from os import makedirs, replace, environ, cpu_count
+from os.path import join as join_paths, exists, dirname
+import numpy
+import polars
+import pyarrow
+import pyarrow.parquet
+import argparse
+
+DEFAULT_TOKENIZER = 'llama3.2'
+DEFAULT_CACHE_FOLDER = './cache/token_counts'
+
+def text_key(text: str) -> bytes:
+    return blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+def load_tokenizer(tokenizer_id: str):
+    """Tokenizer de fundar_llms ('llama3.2', ...) o, si no lo conoce, de HuggingFace por nombre."""
+    try:
+        from fundar_llms.api.tokenizers import get_tokenizer
+        return get_tokenizer(tokenizer_id).auto_tokenizer_from_pretrained()
+    except (KeyError, ValueError):
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(tokenizer_id)
+
+def count_with(tokenizer, texts: Sequence[str]) -> numpy.ndarray:
+    """Lo mismo que len(tokenizer.tokenize(x)) para cada texto, en una sola llamada al tokenizer."""
+    encoded = tokenizer(list(texts), add_special_tokens=False, return_attention_mask=False)
+    return numpy.fromiter(map(len, encoded['input_ids']), dtype=numpy.int64, count=len(texts))
+
+_worker_tokenizer = None
+
+def _init_worker(tokenizer_id: str):
+    global _worker_tokenizer
+    # El paralelismo lo dan los procesos; que cada tokenizer use un solo hilo
+    environ['TOKENIZERS_PARALLELISM'] = 'false'
+    _worker_tokenizer = load_tokenizer(tokenizer_id)
+
+def _count_in_worker(texts: list[str]) -> numpy.ndarray:
+    return count_with(_worker_tokenizer, texts)
+
+class TokenCountCache:
+    """
+    Conteos de tokens de un tokenizer por hash del texto, persistidos en
+    '{folder}/{tokenizer_id}.parquet' (key, token_count).
+    """
+    def __init__(self, folder: str, tokenizer_id: str):
+        self.path = join_paths(folder, tokenizer_id.replace('/', '__') + '.parquet')
+        self.counts: dict[bytes, int] = {}
+        self.dirty = False
+
+        if exists(self.path):
+            table = pyarrow.parquet.read_table(self.path)
+            self.counts = dict(zip(table['key'].to_pylist(), table['token_count'].to_pylist()))
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def get(self, key: bytes) -> int | None:
+        return self.counts.get(key)
+
+    def put_many(self, keys: Sequence[bytes], counts: Sequence[int]):
+        self.counts.update(zip(keys, map(int, counts)))
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        makedirs(dirname(self.path), exist_ok=True)
+        table = pyarrow.table(dict(
+            key = pyarrow.array(list(self.counts), pyarrow.binary(16)),
+            token_count = pyarrow.array(list(self.counts.values()), pyarrow.int64())
+        ))
+        pyarrow.parquet.write_table(table, self.path + '.tmp')
+        replace(self.path + '.tmp', self.path)
+        self.dirty = False
+
+class TokenCounter:
+    """
+    Cuenta tokens consultando primero el cache; los textos que faltan se tokenizan en
+    batches de 'batch_size' en un pool de 'processes' procesos (cada uno carga el tokenizer
+    una vez). Con processes=1 se tokeniza en este proceso.
+    Uso:
+    >>> counter = TokenCounter('llama3.2')
+    >>> counts = counter.frame(polars.read_parquet('../data/arg_embeddings.parquet', columns=['vector_id', 'text']))
+    """
+    def __init__(self,
+                 tokenizer_id: str = DEFAULT_TOKENIZER,
+                 cache_folder: str | None = DEFAULT_CACHE_FOLDER,
+                 processes: int | None = None,
+                 batch_size: int = 1024):
+        self.tokenizer_id = tokenizer_id
+        self.cache = TokenCountCache(cache_folder, tokenizer_id) if cache_folder else None
+        self.processes = processes or cpu_count()
+        self.batch_size = batch_size
+        self._tokenizer = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def tokenizer(self):
+        """El tokenizer de este proceso, cargado la primera vez que se usa."""
+        if self._tokenizer is None:
+            self._tokenizer = load_tokenizer(self.tokenizer_id)
+        return self._tokenizer
+
+    def tokenize_counts(self, texts: list[str]) -> numpy.ndarray:
+        if not texts:
+            return numpy.zeros((0,), dtype=numpy.int64)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        if self.processes == 1 or len(batches) == 1:
+            return numpy.concatenate([count_with(self.tokenizer, batch) for batch in batches])
+
+        with ProcessPoolExecutor(min(self.processes, len(batches)),
+                                 mp_context=get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(self.tokenizer_id,)) as executor:
+            return numpy.concatenate(list(executor.map(_count_in_worker, batches)))
+
+    def count(self, texts: Sequence[str]) -> numpy.ndarray:
+        """Cantidad de tokens de cada texto, en el mismo orden."""
+        texts = list(texts)
+        keys = [text_key(text) for text in texts]
+        counts = numpy.empty((len(texts),), dtype=numpy.int64)
+        missing: dict[bytes, str] = {}
+
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is None:
+                missing.setdefault(key, texts[i])
+            else:
+                counts[i] = cached
+
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_counts = dict(zip(missing, self.tokenize_counts(list(missing.values()))))
+            for i, key in enumerate(keys):
+                if key in new_counts:
+                    counts[i] = new_counts[key]
+
+            if self.cache is not None:
+                self.cache.put_many(list(new_counts), list(new_counts.values()))
+                self.cache.save()
+
+        return counts
+
+    def frame(self, chunks: polars.DataFrame) -> polars.DataFrame:
+        """(vector_id, text) -> (vector_id, text, token_count), el formato de arg_token_counts.parquet."""
+        return chunks.select('vector_id', 'text').with_columns(token_count=polars.Series(self.count(chunks['text'])))
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0
+        return f"Token count cache: {self.hits} hits, {self.misses} tokenized ({ratio:.1%} hit ratio)."
+
+def main(tokenizer: str, input: str, output: str, cache_folder: str, processes: int | None, batch_size: int):
+    counter = TokenCounter(tokenizer, cache_folder, processes, batch_size)
+    counter.frame(polars.read_parquet(input, columns=['vector_id', 'text'])).write_parquet(output)
+    print(counter.stats())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t','--tokenizer', type=str, default=DEFAULT_TOKENIZER, help='Tokenizer id (fundar_llms name or HuggingFace repo)')
+    parser.add_argument('-i','--input', type=str, default='../data/arg_embeddings.parquet', help='Parquet with the vector_id and text of each chunk')
+    parser.add_argument('-o','--output', type=str, default='../data/arg_token_counts.parquet')
+    parser.add_argument('--cache-folder', type=str, default=DEFAULT_CACHE_FOLDER)
+    parser.add_argument('-p','--processes', type=int, default=None, help='Tokenizer processes (default: one per CPU)')
+    parser.add_argument('-b','--batch-size', type=int, default=1024, help='Texts per call to the tokenizer')
+    main(**vars(parser.parse_args()))
@@ -1,12 +1,81 @@
 import numpy
-from safetensors.numpy import save_file, load_file
+import polars
+import pyarrow
+import pyarrow.compute
+import pyarrow.parquet
+from safetensors.numpy import save_file
 from tqdm.auto import tqdm
-from dataclasses import dataclass
-from typing import Iterable
+from dataclasses import dataclass, field
+from functools import cached_property
+from os.path import join as join_paths
+from typing import Iterable, Sequence
+import json
+import os
+
+VECTOR_DIM = 768
+VECTOR_COLUMN = 'vector'
 
 def subdict(d, keys):
     return {k: d[k] for k in keys}
 
+def vectors_to_arrow(vectors: numpy.ndarray | Sequence[Iterable[float]]) -> pyarrow.FixedSizeListArray:
+    """Convierte una matriz (N, D) en una columna de Arrow de listas de tamaño fijo D, en float32."""
+    matrix = numpy.ascontiguousarray(vectors, dtype=numpy.float32)
+    if matrix.ndim != 2:
+        # Sin filas no se puede inferir la dimensión
+        matrix = matrix.reshape(len(matrix), -1) if len(matrix) else matrix.reshape(0, VECTOR_DIM)
+    return pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(matrix.reshape(-1)), matrix.shape[1])
+
+def arrow_to_vectors(column: pyarrow.Array | pyarrow.ChunkedArray) -> numpy.ndarray:
+    """
+    Convierte una columna de listas de tamaño fijo en una matriz (N, D).
+    Si la columna está en un solo bloque no se copian los datos.
+    """
+    if isinstance(column, pyarrow.ChunkedArray):
+        column = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+    dim = column.type.list_size
+    return column.flatten().to_numpy(zero_copy_only=True).reshape(-1, dim)
+
+def is_wide_vector_schema(schema: pyarrow.Schema, dim: int = VECTOR_DIM) -> bool:
+    return VECTOR_COLUMN not in schema.names and all(str(i) in schema.names for i in range(dim))
+
+def read_vectors(path: str, columns: list[str] | None = None, dim: int = VECTOR_DIM) -> tuple[pyarrow.Table, numpy.ndarray]:
+    """
+    Lee un parquet de vectores y devuelve el resto de las columnas como tabla
+    de Arrow y los vectores como matriz (N, D) en float32.
+    Acepta tanto el formato columnar (una columna 'vector') como el formato
+    ancho anterior, con una columna por componente ("0".."767").
+    Uso:
+    >>> metadata, vectors = read_vectors('../data/q0_embeddings.parquet', columns=['vector_id'])
+    """
+    schema = pyarrow.parquet.read_schema(path)
+
+    if is_wide_vector_schema(schema, dim):
+        return read_wide_vectors(path, columns, dim)
+
+    table = pyarrow.parquet.read_table(path, columns=None if columns is None else [*columns, VECTOR_COLUMN], memory_map=True)
+    return table.drop_columns([VECTOR_COLUMN]), arrow_to_vectors(table[VECTOR_COLUMN])
+
+def read_wide_vectors(path: str, columns: list[str] | None = None, dim: int = VECTOR_DIM) -> tuple[pyarrow.Table, numpy.ndarray]:
+    """Lector de compatibilidad para los parquet con una columna por componente."""
+    vector_columns = [str(i) for i in range(dim)]
+    table = pyarrow.parquet.read_table(path, memory_map=True)
+
+    vectors = numpy.empty((table.num_rows, dim), dtype=numpy.float32)
+    for i, name in enumerate(vector_columns):
+        vectors[:, i] = table[name].to_numpy()
+
+    metadata = table.drop_columns(vector_columns)
+    if columns is not None:
+        metadata = metadata.select(columns)
+
+    return metadata, vectors
+
+def convert_wide_vectors(path: str, output_path: str | None = None, dim: int = VECTOR_DIM):
+    """Reescribe un parquet del formato ancho al formato columnar."""
+    metadata, vectors = read_wide_vectors(path, dim=dim)
+    pyarrow.parquet.write_table(metadata.append_column(VECTOR_COLUMN, vectors_to_arrow(vectors)), output_path or path)
+
 @dataclass
 class TaggedVector:
     vector_id: str
@@ -26,14 +95,15 @@ class TaggedVector:
                 distance_to=q,
                 distance=distance
             )
-        
+
         return _
 
     @classmethod
     def from_record(cls, data: dict):
-        vector = numpy.zeros((768,))
-        for i in range(768):
-            vector[i] = data[str(i)]
+        if VECTOR_COLUMN in data:
+            vector = numpy.asarray(data[VECTOR_COLUMN], dtype=numpy.float32)
+        else:
+            vector = numpy.fromiter((data[str(i)] for i in range(VECTOR_DIM)), dtype=numpy.float32, count=VECTOR_DIM)
         return cls(
             vector_id = data['vector_id'],
             text = data['text'],
@@ -43,9 +113,354 @@ class TaggedVector:
         )
 
     def as_record(self) -> dict:
-        return (dict(
+        return dict(
             vector_id = self.vector_id,
             text = self.text,
             distance_to = self.distance_to,
-            distance = self.distance)
-            | {str(i): x for i,x in enumerate(self.vector)})
\ No newline at end of file
+            distance = self.distance,
+            vector = numpy.asarray(self.vector, dtype=numpy.float32))
+
+    @staticmethod
+    def to_arrow(vectors: Sequence['TaggedVector']) -> pyarrow.Table:
+        return pyarrow.table(dict(
+            vector_id   = pyarrow.array([x.vector_id for x in vectors], pyarrow.string()),
+            text        = pyarrow.array([x.text for x in vectors], pyarrow.string()),
+            distance_to = pyarrow.array([x.distance_to for x in vectors], pyarrow.string()),
+            distance    = pyarrow.array([x.distance for x in vectors], pyarrow.float64()),
+            vector      = vectors_to_arrow([x.vector for x in vectors]),
+        ))
+
+    @staticmethod
+    def write_parquet(vectors: Sequence['TaggedVector'], path: str):
+        pyarrow.parquet.write_table(TaggedVector.to_arrow(vectors), path)
+
+    @classmethod
+    def read_parquet(cls, path: str) -> list['TaggedVector']:
+        metadata, vectors = read_vectors(path, columns=['vector_id', 'text', 'distance_to', 'distance'])
+        return [
+            cls(vector=vector, **row)
+            for row, vector in zip(metadata.to_pylist(), vectors)
+        ]
+
+class TaggedVectorView:
+    """Vista de una fila de un TaggedVectorBatch, con la misma interfaz que TaggedVector."""
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch: 'TaggedVectorBatch', index: int):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def vector_id(self) -> str:
+        return self.batch.vector_ids[self.index].as_py()
+
+    @property
+    def text(self) -> str:
+        return self.batch.texts[self.index].as_py()
+
+    @property
+    def vector(self) -> numpy.ndarray:
+        return self.batch.vectors[self.index]
+
+    @property
+    def distance_to(self) -> str:
+        return self.batch.distance_to
+
+    @property
+    def distance(self) -> float:
+        return float(self.batch.distances[self.index])
+
+    def as_record(self) -> dict:
+        return self.to_tagged_vector().as_record()
+
+    def to_tagged_vector(self) -> TaggedVector:
+        return TaggedVector(vector_id=self.vector_id, text=self.text, vector=self.vector,
+                            distance_to=self.distance_to, distance=self.distance)
+
+    def __repr__(self):
+        return f"TaggedVectorView(vector_id={self.vector_id!r}, distance_to={self.distance_to!r}, distance={self.distance})"
+
+@dataclass(eq=False)
+class TaggedVectorBatch:
+    """
+    Resultado de una consulta guardado en arreglos contiguos: ids y textos como
+    arreglos de Arrow, distancias como float64 y los vectores como una matriz (N, D)
+    en float32. Se convierte a Arrow/polars sin recorrer las filas en Python.
+    'extra' tiene columnas adicionales por fila (por ejemplo 'presidente').
+    Uso:
+    >>> batch = TaggedVectorBatch.from_query_result(arg.query(...), distance_to='q0')
+    >>> batch.sorted_by_distance().write_parquet('../data/q0_embeddings.parquet')
+    """
+    vector_ids: pyarrow.Array
+    texts: pyarrow.Array
+    distances: numpy.ndarray
+    vectors: numpy.ndarray
+    distance_to: str
+    extra: dict[str, pyarrow.Array] = field(default_factory=dict)
+
+    COLUMNS = ('vector_id', 'text', 'distance_to', 'distance', VECTOR_COLUMN)
+
+    def __post_init__(self):
+        if not (len(self.vector_ids) == len(self.texts) == len(self.distances) == len(self.vectors)):
+            raise ValueError("vector_ids, texts, distances and vectors must have the same length")
+        if any(len(column) != len(self.distances) for column in self.extra.values()):
+            raise ValueError("Extra columns must have one value per vector")
+
+    def __len__(self) -> int:
+        return len(self.distances)
+
+    def __iter__(self):
+        return (TaggedVectorView(self, i) for i in range(len(self)))
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, numpy.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(index)
+            return TaggedVectorView(self, int(index))
+        return self.take(numpy.arange(len(self))[index])
+
+    def take(self, indices) -> 'TaggedVectorBatch':
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        return TaggedVectorBatch(
+            vector_ids = self.vector_ids.take(indices),
+            texts = self.texts.take(indices),
+            distances = self.distances[indices],
+            vectors = self.vectors[indices],
+            distance_to = self.distance_to,
+            extra = {name: column.take(indices) for name, column in self.extra.items()}
+        )
+
+    def sorted_by_distance(self, descending: bool = True) -> 'TaggedVectorBatch':
+        order = numpy.argsort(-self.distances if descending else self.distances, kind='stable')
+        return self.take(order)
+
+    @classmethod
+    def from_arrays(cls, vector_ids, texts, distances, vectors, distance_to: str) -> 'TaggedVectorBatch':
+        vectors = numpy.ascontiguousarray(vectors, dtype=numpy.float32)
+        if vectors.size == 0 and vectors.ndim != 2:
+            vectors = vectors.reshape(0, VECTOR_DIM)
+        return cls(
+            vector_ids = pyarrow.array(vector_ids, pyarrow.string()),
+            texts = pyarrow.array(texts, pyarrow.string()),
+            distances = numpy.asarray(distances, dtype=numpy.float64),
+            vectors = vectors,
+            distance_to = distance_to
+        )
+
+    @classmethod
+    def from_query_result(cls, result: dict, distance_to: str, index: int = 0) -> 'TaggedVectorBatch':
+        """Arma el batch a partir del resultado de collection.query (la consulta número 'index')."""
+        return cls.from_arrays(
+            vector_ids = result['ids'][index],
+            texts = result['documents'][index],
+            distances = result['distances'][index],
+            vectors = result['embeddings'][index],
+            distance_to = distance_to
+        )
+
+    @classmethod
+    def from_tagged_vectors(cls, vectors: Sequence[TaggedVector]) -> 'TaggedVectorBatch':
+        distance_to = {x.distance_to for x in vectors}
+        if len(distance_to) > 1:
+            raise ValueError(f"All the vectors must be tagged to the same question, got {distance_to}")
+        if not vectors:
+            return cls.from_arrays([], [], [], numpy.zeros((0, VECTOR_DIM), dtype=numpy.float32), distance_to='')
+        return cls.from_arrays(
+            vector_ids = [x.vector_id for x in vectors],
+            texts = [x.text for x in vectors],
+            distances = [x.distance for x in vectors],
+            vectors = [x.vector for x in vectors],
+            distance_to = distance_to.pop()
+        )
+
+    def to_arrow(self) -> pyarrow.Table:
+        return pyarrow.table(dict(
+            vector_id   = self.vector_ids,
+            text        = self.texts,
+            distance_to = pyarrow.repeat(pyarrow.scalar(self.distance_to, pyarrow.string()), len(self)),
+            distance    = self.distances,
+            **self.extra,
+            vector      = vectors_to_arrow(self.vectors.reshape(len(self), self.vectors.shape[-1])),
+        ))
+
+    @classmethod
+    def from_arrow(cls, table: pyarrow.Table) -> 'TaggedVectorBatch':
+        distance_to = pyarrow.compute.unique(table['distance_to']).to_pylist()
+        if len(distance_to) > 1:
+            raise ValueError(f"All the rows must be tagged to the same question, got {distance_to}")
+        return cls(
+            vector_ids = table['vector_id'].combine_chunks(),
+            texts = table['text'].combine_chunks(),
+            distances = table['distance'].to_numpy().astype(numpy.float64, copy=False),
+            vectors = arrow_to_vectors(table[VECTOR_COLUMN]),
+            distance_to = distance_to[0] if distance_to else '',
+            extra = {name: table[name].combine_chunks() for name in table.column_names if name not in cls.COLUMNS}
+        )
+
+    def to_polars(self) -> polars.DataFrame:
+        return polars.from_arrow(self.to_arrow())
+
+    @classmethod
+    def from_polars(cls, df: polars.DataFrame) -> 'TaggedVectorBatch':
+        return cls.from_arrow(df.to_arrow())
+
+    def write_parquet(self, path: str):
+        pyarrow.parquet.write_table(self.to_arrow(), path)
+
+    @classmethod
+    def read_parquet(cls, path: str) -> 'TaggedVectorBatch':
+        metadata, vectors = read_vectors(path)
+        return cls.from_arrow(metadata.append_column(VECTOR_COLUMN, vectors_to_arrow(vectors)))
+
+def mmap_safetensors(path: str, name: str) -> numpy.ndarray:
+    """
+    Abre un tensor de un archivo safetensors como numpy.memmap de solo lectura.
+    El formato es: 8 bytes (u64 little-endian) con el largo del header, el header
+    en JSON y después los datos, así que alcanza con leer el header.
+    """
+    dtypes = {'F16': numpy.float16, 'F32': numpy.float32, 'F64': numpy.float64}
+
+    with open(path, 'rb') as f:
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+
+    info = header[name]
+    begin, end = info['data_offsets']
+    shape = tuple(info['shape'])
+
+    if begin == end:
+        return numpy.zeros(shape, dtype=dtypes[info['dtype']])
+
+    return numpy.memmap(path, dtype=dtypes[info['dtype']], mode='r', offset=8 + header_size + begin, shape=shape)
+
+class EmbeddingStore:
+    """
+    Matriz de embeddings persistida en safetensors más un índice vector_id -> fila
+    en parquet (con el texto y la metadata de cada chunk). Se abre como memmap, así
+    que abrirla no lee los vectores, y 'gather' trae sólo las filas pedidas.
+    Estructura de la carpeta:
+        embeddings.safetensors  tensor 'vectors' (N, D) float32
+        index.parquet           vector_id, text y metadata, en el orden de las filas
+    Uso:
+    >>> store = EmbeddingStore.from_chroma(client.get_collection('imf_publications_arg'), '../data/arg_store')
+    >>> store = EmbeddingStore.open('../data/arg_store')
+    >>> vectors = store.gather(['...', '...'])
+    """
+    VECTORS_FILE = 'embeddings.safetensors'
+    INDEX_FILE = 'index.parquet'
+    TENSOR_NAME = 'vectors'
+
+    def __init__(self, folder: str, vectors: numpy.ndarray, vector_ids: list[str]):
+        self.folder = folder
+        self.vectors = vectors
+        self.vector_ids = vector_ids
+
+    def __len__(self) -> int:
+        return len(self.vector_ids)
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self.rows_by_id
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @cached_property
+    def rows_by_id(self) -> dict[str, int]:
+        return {vector_id: i for i, vector_id in enumerate(self.vector_ids)}
+
+    @cached_property
+    def metadata(self) -> polars.DataFrame:
+        """Índice completo (vector_id, text y metadata), en el orden de las filas."""
+        return polars.read_parquet(join_paths(self.folder, self.INDEX_FILE))
+
+    @cached_property
+    def id_array(self) -> pyarrow.Array:
+        """vector_ids como arreglo de Arrow, para hacer 'take' sin reconvertir la lista en cada consulta."""
+        return pyarrow.array(self.vector_ids, pyarrow.string())
+
+    @cached_property
+    def text_array(self) -> pyarrow.Array:
+        return self.metadata['text'].to_arrow()
+
+    def rows(self, vector_ids: Iterable[str]) -> numpy.ndarray:
+        rows_by_id = self.rows_by_id
+        try:
+            return numpy.fromiter((rows_by_id[x] for x in vector_ids), dtype=numpy.int64)
+        except KeyError as e:
+            raise KeyError(f"vector_id {e.args[0]!r} is not in the store at {self.folder}") from None
+
+    def gather(self, vector_ids: Iterable[str]) -> numpy.ndarray:
+        """Devuelve una matriz (len(vector_ids), D) con los vectores pedidos, en ese orden."""
+        return self.take(self.rows(vector_ids))
+
+    def take(self, rows: numpy.ndarray) -> numpy.ndarray:
+        """Devuelve una matriz (len(rows), D) con las filas pedidas, en ese orden."""
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        # Leer las filas en orden creciente hace que el acceso al memmap sea secuencial
+        order = numpy.argsort(rows, kind='stable')
+        result = numpy.empty((len(rows), self.dim), dtype=numpy.float32)
+        result[order] = self.vectors[rows[order]]
+        return result
+
+    @classmethod
+    def open(cls, folder: str) -> 'EmbeddingStore':
+        vectors = mmap_safetensors(join_paths(folder, cls.VECTORS_FILE), cls.TENSOR_NAME)
+        vector_ids = pyarrow.parquet.read_table(join_paths(folder, cls.INDEX_FILE), columns=['vector_id'])['vector_id'].to_pylist()
+        if len(vector_ids) != len(vectors):
+            raise ValueError(f"Corrupted store at {folder}: {len(vector_ids)} ids for {len(vectors)} vectors")
+        return cls(folder, vectors, vector_ids)
+
+    @classmethod
+    def write(cls, folder: str, vectors: numpy.ndarray, index: polars.DataFrame, metadata: dict[str, str] | None = None) -> 'EmbeddingStore':
+        """Guarda la matriz y el índice (que tiene que tener una columna 'vector_id') y devuelve el store abierto."""
+        if 'vector_id' not in index.columns:
+            raise ValueError("The index must have a 'vector_id' column")
+        if len(index) != len(vectors):
+            raise ValueError(f"Got {len(index)} index rows for {len(vectors)} vectors")
+        if index['vector_id'].is_duplicated().any():
+            raise ValueError("The index has duplicated vector_ids")
+
+        os.makedirs(folder, exist_ok=True)
+        vectors_path = join_paths(folder, cls.VECTORS_FILE)
+        index_path = join_paths(folder, cls.INDEX_FILE)
+
+        # Se escribe a archivos temporales y se reemplaza, para no dejar un store a medias
+        save_file({cls.TENSOR_NAME: numpy.ascontiguousarray(vectors, dtype=numpy.float32)}, vectors_path + '.tmp', metadata=metadata)
+        index.write_parquet(index_path + '.tmp')
+        os.replace(vectors_path + '.tmp', vectors_path)
+        os.replace(index_path + '.tmp', index_path)
+
+        return cls.open(folder)
+
+    @classmethod
+    def from_chroma(cls, collection, folder: str, page_size: int = 10_000) -> 'EmbeddingStore':
+        """Copia todos los vectores de una colección de Chroma, paginando con limit/offset."""
+        count = collection.count()
+        vectors = None
+        ids, texts, metadatas = [], [], []
+
+        with tqdm(total=count, desc=f"Exporting {collection.name}") as progress:
+            for offset in range(0, count, page_size):
+                page = collection.get(limit=page_size, offset=offset, include=['embeddings', 'documents', 'metadatas'])
+                embeddings = numpy.asarray(page['embeddings'], dtype=numpy.float32)
+
+                if vectors is None:
+                    vectors = numpy.empty((count, embeddings.shape[1]), dtype=numpy.float32)
+
+                vectors[len(ids):len(ids) + len(embeddings)] = embeddings
+                ids.extend(page['ids'])
+                texts.extend(page['documents'])
+                metadatas.extend(m or {} for m in page['metadatas'])
+                progress.update(len(embeddings))
+
+        if vectors is None:
+            vectors = numpy.zeros((0, VECTOR_DIM), dtype=numpy.float32)
+
+        index = polars.DataFrame(dict(vector_id=ids, text=texts), schema=dict(vector_id=polars.String, text=polars.String))
+        if any(metadatas):
+            index = index.hstack(polars.DataFrame(metadatas, infer_schema_length=None))
+
+        return cls.write(folder, vectors[:len(ids)], index, metadata=dict(collection=collection.name))
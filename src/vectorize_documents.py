@@ -1,29 +1,55 @@
 # Usage:
-# python vectorize_documents.py -t ARG UKR -p ./persist -h multiprocess
+# python vectorize_documents.py -t ARG UKR -p ./persist -m multiprocess --pages-per-shard 32
+# python vectorize_documents.py -t ARG UKR -p ./persist --incremental
+
+from __future__ import annotations
+
+# Las dependencias pesadas (chromadb, langchain, tqdm, torch) se importan
+# recién en las funciones que las usan, para que '--help', los errores de
+# argumentos y los workers que solo parsean PDFs arranquen rápido.
+# benchmarks/import_time.py controla que siga siendo así.
 
-import chromadb.errors
-from tqdm.contrib.concurrent import process_map
-from langchain_core.documents import Document
 from glob import glob
 from os.path import join as join_paths
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from multiprocessing import cpu_count
-from collections.abc import Iterable
-from typing import TypeVar
-from functools import reduce
-from tqdm.auto import tqdm
+from pdf_extraction import file_hash, load_pdf_pages, get_backend, page_ranges, PdfPageCache, PDF_BACKENDS, DEFAULT_PDF_BACKEND
+from multiprocessing import cpu_count, get_context
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from collections.abc import Iterable, Iterator
+from threading import Thread
+from queue import Queue
+from typing import TypeVar, TYPE_CHECKING
+from dataclasses import dataclass, field
+from functools import partial, cache
+from collections import defaultdict, deque
+from itertools import islice, groupby
+from hashlib import sha256
 # from uuid import uuid4 as get_uuid
-from uuid import uuid4, uuid5, NAMESPACE_OID, UUID
-import chromadb
+from uuid import uuid5, NAMESPACE_OID, UUID
 import argparse
+import ntpath
+import json
 import sys
 
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+VALID_COUNTRIES = ['ARG', 'TUR', 'UKR', 'EGY']
+DEFAULT_PRESIDENCIES_FILE = '../data/docs_por_presidencia.json'
+
 def get_id(x: str, cast_str=True) -> str | UUID:
-    # uid = uuid5(NAMESPACE_OID, x)
-    uid = uuid4()
+    uid = uuid5(NAMESPACE_OID, x)
     return str(uid) if cast_str else uid
 
+def text_hash(text: str) -> str:
+    return sha256(text.encode('utf-8')).hexdigest()
+
+def get_chunk_id(doc: Document) -> str:
+    # start_index es relativo a la página, por eso la página también forma parte de la clave.
+    metadata = doc.metadata
+    key = f"{metadata['file_hash']}:{metadata.get('page', 0)}:{metadata['start_index']}:{text_hash(doc.page_content)}"
+    return get_id(key)
+
 T = TypeVar('T')
 
 is_verbose = False
@@ -32,149 +58,577 @@ def debug_print(*args, **kwargs):
     if is_verbose:
         print(*args, **kwargs)
 
-def flatten(nested_list: list[list[T]], max_level=5) -> list[T]:
-    return _flatten(nested_list, max_level)
-
-def _flatten(nested_list: list[T | list[T]], current_level) -> list[T]:
-    if current_level == 0:
-        return nested_list
-    else:
-        return _flatten([item for sublist in nested_list for item in sublist if isinstance(item, Iterable)], current_level-1)
+def batched(iterable: Iterable[T], batch_size: int) -> Iterator[list[T]]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+_END_OF_STREAM = object()
+
+class _StreamError:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+def iter_in_thread(iterable: Iterable[T], maxsize: int) -> Iterator[T]:
+    """
+    Consume 'iterable' en un hilo aparte y entrega sus elementos
+    a través de una cola acotada, de manera que la etapa productora
+    avance en paralelo con la consumidora sin acumular más de
+    'maxsize' elementos en memoria.
+    """
+    queue: Queue = Queue(maxsize=maxsize)
+
+    def produce():
+        try:
+            for item in iterable:
+                queue.put(item)
+        except BaseException as e:
+            queue.put(_StreamError(e))
+        finally:
+            queue.put(_END_OF_STREAM)
+
+    Thread(target=produce, daemon=True).start()
+
+    while (item := queue.get()) is not _END_OF_STREAM:
+        if isinstance(item, _StreamError):
+            raise item.exception
+        yield item
+
+def load_and_split_pdf(file_path: str, backend: str = DEFAULT_PDF_BACKEND, splitter = None, cache_folder: str | None = None) -> list[Document]:
+    splitter = splitter or get_default_splitter()
+
+    return splitter.split_documents(load_pdf_pages(file_path, backend, cache_folder))
+
+Shard = tuple[str, int | None, int | None]
+
+def load_and_split_shard(shard: Shard, backend: str = DEFAULT_PDF_BACKEND, cache_folder: str | None = None) -> tuple[list[Document] | None, list[Document]]:
+    """
+    Un shard es (archivo, página inicial, página final). Si no tiene rango,
+    el archivo se carga entero a través del cache de extracción. Si lo tiene,
+    se extraen solo esas páginas y se devuelven junto con los chunks, para
+    poder cachear el archivo completo una vez que terminen todos sus shards.
+    Como el splitter trabaja página por página, concatenar los chunks de los
+    shards da el mismo resultado (y los mismos start_index) que el archivo entero.
+    """
+    file_path, start, stop = shard
+
+    if start is None:
+        return None, load_and_split_pdf(file_path, backend, cache_folder=cache_folder)
+
+    pages = get_backend(backend).extract_pages(file_path, start, stop)
+    return pages, get_default_splitter().split_documents(pages)
+
+def plan_shards(files: list[str], backend: str, pages_per_shard: int | None, cached=lambda file: False) -> list[Shard]:
+    if not pages_per_shard:
+        return [(file, None, None) for file in files]
+
+    extractor = get_backend(backend)
+    shards = []
+
+    for file in files:
+        ranges = [] if cached(file) else page_ranges(extractor.page_count(file), pages_per_shard)
+        if len(ranges) > 1:
+            shards.extend((file, start, stop) for start, stop in ranges)
+        else:
+            shards.append((file, None, None))
 
-def split_list_into_chunks(lst, chunk_size):
-    return [lst[i:j] for i, j in 
-            ((i, i + chunk_size) 
-                for i in range(0, len(lst), chunk_size))]
+    return shards
 
-def load_and_split_pdf(file_path: str, loader = None, splitter = None) -> list[str]:
-    loader = loader or PyPDFLoader
-    splitter = splitter or DEFAULT_RCT_SPLITTER
+def list_country_files(country: str, docs_path='../docs/') -> list[str]:
+    return sorted(glob(join_paths(docs_path, country.upper() + '*.pdf')))
 
-    return splitter.split_documents(loader(file_path).load())
+def load_presidencies(path: str | None = DEFAULT_PRESIDENCIES_FILE) -> dict[str, str]:
+    """
+    Lee docs_por_presidencia.json ({presidente: [rutas]}) y devuelve {nombre de archivo: presidente}.
+    Las rutas del json pueden tener separadores de Windows, por eso se compara solo el nombre.
+    """
+    if path is None:
+        return {}
 
-def load_country_publications(country: str, docs_path='../docs/', how='multiprocess') -> list[list[Document]]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            docs_by_president = json.load(f)
+    except FileNotFoundError:
+        debug_print(f"{path} not found, chunks won't have a 'presidente'.")
+        return {}
+
+    return {ntpath.basename(doc): president for president, docs in docs_by_president.items() for doc in docs}
+
+def presidency_of(file: str, presidencies: dict[str, str]) -> str | None:
+    return presidencies.get(ntpath.basename(file))
+
+def iter_ordered(executor, function, items: list[T], max_pending: int) -> Iterator[tuple[T, object]]:
+    """
+    Como 'executor.map', pero con a lo sumo 'max_pending' tareas en vuelo,
+    para no acumular resultados si el consumidor es más lento que los workers.
+    """
+    pending = deque()
+    items_iter = iter(items)
+
+    def submit_next():
+        for item in islice(items_iter, 1):
+            pending.append((item, executor.submit(function, item)))
+
+    for _ in range(max_pending):
+        submit_next()
+
+    while pending:
+        item, future = pending.popleft()
+        result = future.result()
+        submit_next()
+        yield item, result
+
+def iter_publications(files: list[str], 
+                      how='multiprocess', 
+                      max_pending: int | None = None, 
+                      cache_folder: str | None = None,
+                      backend: str = DEFAULT_PDF_BACKEND,
+                      pages_per_shard: int | None = 32,
+                      file_hashes: dict[str, str] | None = None) -> Iterator[tuple[str, list[Document]]]:
+    """
+    Devuelve los chunks de cada archivo en orden, a medida que los workers los van terminando.
+    Los PDFs que no están en el cache de extracción se reparten en rangos de
+    'pages_per_shard' páginas, para que los documentos largos no dejen al
+    resto de los workers sin trabajo.
+    """
+    from tqdm.auto import tqdm
+
+    file_hashes = file_hashes or {}
+    digest = lambda file: file_hashes.get(file) or file_hash(file)
+    cache = PdfPageCache(cache_folder, get_backend(backend).extractor_id) if cache_folder is not None else None
+    cached = (lambda file: digest(file) in cache) if cache is not None else (lambda file: False)
+    load = partial(load_and_split_shard, backend=backend, cache_folder=cache_folder)
+
+    if how == 'singleprocess':
+        shards = plan_shards(files, backend, None)
+        results = ((shard, load(shard)) for shard in shards)
+    elif how == 'multiprocess':
+        max_workers = cpu_count()
+        # 'spawn': para este punto el proceso ya tiene hilos (las etapas del pipeline, el pool
+        # de polars) y un fork puede heredar un lock tomado y quedar colgado
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context('spawn'))
+        shards = plan_shards(files, backend, pages_per_shard, cached)
+        results = iter_ordered(executor, load, shards, max_pending or 2 * max_workers)
+    else:
+        raise ValueError(f"Invalid value for 'how' argument. Expected one of ['multiprocess', 'singleprocess']")
 
-    options = {
-        'multiprocess': lambda x: process_map(load_and_split_pdf, x, max_workers=cpu_count()),
-        'singleprocess': lambda x: list(map(load_and_split_pdf, x))
+    try:
+        with tqdm(total=len(shards)) as pbar:
+            for file, file_results in groupby(results, key=lambda x: x[0][0]):
+                pages, chunks = [], []
+                for _, (shard_pages, shard_chunks) in file_results:
+                    if shard_pages is not None:
+                        pages.extend(shard_pages)
+                    chunks.extend(shard_chunks)
+                    pbar.update(1)
+
+                if cache is not None and pages:
+                    cache.save(digest(file), pages)
+
+                yield file, chunks
+    finally:
+        if how == 'multiprocess':
+            executor.shutdown(cancel_futures=True)
+
+def get_indexed_sources(collection, batch_size: int) -> dict[str, tuple[set[tuple[str, str | None]], set[str]]]:
+    """
+    Recorre la colección y devuelve, por cada 'source', los pares
+    (hash de archivo, presidente) con los que fue indexado y los ids de sus chunks.
+    """
+    indexed: dict[str, tuple[set[tuple[str, str | None]], set[str]]] = defaultdict(lambda: (set(), set()))
+    offset = 0
+
+    while True:
+        page = collection.get(include=['metadatas'], limit=batch_size, offset=offset)
+        if not page['ids']:
+            break
+
+        for chunk_id, metadata in zip(page['ids'], page['metadatas']):
+            hashes, ids = indexed[metadata.get('source')]
+            hashes.add((metadata.get('file_hash'), metadata.get('presidente')))
+            ids.add(chunk_id)
+
+        offset += len(page['ids'])
+
+    return dict(indexed)
+
+def write_to_collection(collection, documents, metadatas, ids, embeddings, max_batch_size: int, method='add'):
+    write = getattr(collection, method)
+
+    for i in range(0, len(ids), max_batch_size):
+        write(
+            documents  = list(documents[i:i + max_batch_size]),
+            metadatas  = list(metadatas[i:i + max_batch_size]),
+            ids        = list(ids[i:i + max_batch_size]),
+            embeddings = list(embeddings[i:i + max_batch_size])
+        )
+
+@dataclass(eq=False)
+class CountryJob:
+    """
+    Estado de la vectorización de un país a lo largo del pipeline:
+    su colección, qué publicaciones hay que cargar, qué chunks borrar,
+    y cuándo terminó cada etapa para ese país.
+    """
+    country: str
+    collection: object
+    method: str
+    file_hashes: dict[str, str]
+    indexed: dict[str, tuple[set[tuple[str, str | None]], set[str]]]
+    files_to_load: list[str]
+    stale_ids: set[str]
+    presidencies: dict[str, str | None] = field(default_factory=dict)
+    chunks: int = 0
+    written: int = 0
+    write_intervals: list[tuple[float, float]] = field(default_factory=list)
+    timings: dict[str, list[float]] = field(default_factory=dict)
+
+    def mark(self, stage: str):
+        now = perf_counter()
+        self.timings.setdefault(stage, [now, now])[1] = now
+
+    @property
+    def write_seconds(self) -> float:
+        """Tiempo de reloj en que hubo al menos una escritura en curso (las de distintos hilos se solapan)."""
+        total, covered_until = 0.0, float('-inf')
+        for start, end in sorted(self.write_intervals):
+            total += max(0.0, end - max(start, covered_until))
+            covered_until = max(covered_until, end)
+        return total
+
+def iter_new_chunks(publications: Iterable[tuple[str, list[Document]]],
+                    jobs_by_file: dict[str, CountryJob]) -> Iterator[tuple[CountryJob, str, Document]]:
+    """
+    Asigna ids y presidente a los chunks de cada publicación y devuelve solo
+    aquellos que todavía no están en la colección de su país. Los ids indexados
+    que ya no corresponden a ningún chunk se agregan a 'stale_ids' del país.
+    """
+    for source, chunks in publications:
+        job = jobs_by_file[source]
+        job.mark('parse')
+        previous, previous_ids = job.indexed.get(source, (set(), set()))
+        president = job.presidencies.get(source)
+        chunk_ids = set()
+
+        # Si cambió la presidencia asignada a la publicación, sus chunks se reescriben aunque ya estén indexados
+        reusable_ids = previous_ids if all(p == president for _, p in previous) else set()
+
+        for doc in chunks:
+            doc.metadata['file_hash'] = job.file_hashes[source]
+            if president is not None:
+                doc.metadata['presidente'] = president
+            chunk_id = get_chunk_id(doc)
+            chunk_ids.add(chunk_id)
+
+            if chunk_id not in reusable_ids:
+                job.chunks += 1
+                yield job, chunk_id, doc
+
+        job.stale_ids |= previous_ids - chunk_ids
+
+def iter_embedded_batches(chunks: Iterable[tuple[CountryJob, str, Document]], batch_size: int, device: str) -> Iterator[tuple[list, list, list, list, list]]:
+    for batch in batched(chunks, batch_size):
+        jobs, ids, docs = zip(*batch)
+        texts = [doc.page_content for doc in docs]
+        metadatas = [doc.metadata for doc in docs]
+        embeddings = model.encode(texts, device=device).tolist()
+
+        for job in set(jobs):
+            job.mark('embed')
+
+        yield list(jobs), texts, metadatas, list(ids), embeddings
+
+def stream_to_collections(batches: Iterable[tuple[list, list, list, list, list]], 
+                          max_batch_size: int, 
+                          writers: int = 1):
+    """
+    Escribe los lotes embebidos en la colección de cada país, reagrupándolos
+    en escrituras de a lo sumo 'max_batch_size' elementos que se reparten
+    entre 'writers' hilos.
+    """
+    buffers: dict[CountryJob, tuple[list, list, list, list]] = defaultdict(lambda: ([], [], [], []))
+
+    def write(job: CountryJob, batch: tuple[list, list, list, list]):
+        start = perf_counter()
+        write_to_collection(job.collection, *batch, max_batch_size, method=job.method)
+        job.write_intervals.append((start, perf_counter()))
+        job.written += len(batch[2])
+        job.mark('write')
+
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        pending = deque()
+
+        def flush(job: CountryJob, n: int):
+            buffer = buffers[job]
+            batch = tuple(x[:n] for x in buffer)
+            for x in buffer:
+                del x[:n]
+
+            pending.append(executor.submit(write, job, batch))
+            while len(pending) > 2 * writers:
+                pending.popleft().result()
+
+        for jobs, *columns in batches:
+            for i, job in enumerate(jobs):
+                for x, column in zip(buffers[job], columns):
+                    x.append(column[i])
+
+            for job in set(jobs):
+                while len(buffers[job][2]) >= max_batch_size:
+                    flush(job, max_batch_size)
+
+        for job, buffer in buffers.items():
+            if buffer[2]:
+                flush(job, len(buffer[2]))
+
+        while pending:
+            pending.popleft().result()
+
+def hnsw_metadata(space='cosine',
+                  M: int | None = None,
+                  construction_ef: int | None = None,
+                  search_ef: int | None = None,
+                  num_threads: int | None = None,
+                  batch_size: int | None = None,
+                  sync_threshold: int | None = None) -> dict:
+    """
+    Metadata de la colección con los parámetros del índice HNSW.
+    Los que quedan en None usan los valores por defecto de Chroma.
+    """
+    params = {
+        'hnsw:space': space,
+        'hnsw:M': M,
+        'hnsw:construction_ef': construction_ef,
+        'hnsw:search_ef': search_ef,
+        'hnsw:num_threads': num_threads,
+        'hnsw:batch_size': batch_size,
+        'hnsw:sync_threshold': sync_threshold,
     }
+    return {k: v for k, v in params.items() if v is not None}
 
-    if how not in options:
-        raise ValueError(f"Invalid value for 'how' argument. Expected one of {options.keys()}")
+def delete_from_collection(collection, ids, max_batch_size: int):
+    ids = list(ids)
+    for i in range(0, len(ids), max_batch_size):
+        collection.delete(ids=ids[i:i + max_batch_size])
 
-    files = glob(join_paths(docs_path, country.upper() + '*.pdf'))
-    load_publications = options[how]
-
-    return load_publications(files)
-
-DEFAULT_RCT_SPLITTER = RecursiveCharacterTextSplitter(
+@cache
+def get_default_splitter():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
         separators=["\n\n", "\n", "(?<=\. )", " ", "", "-\n"],
         chunk_size=1000,
         chunk_overlap=0,
         add_start_index=True
-)
+    )
+
+def __getattr__(name: str):
+    # Compatibilidad con 'from vectorize_documents import DEFAULT_RCT_SPLITTER'
+    if name == 'DEFAULT_RCT_SPLITTER':
+        return get_default_splitter()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 embedding_model_name = 'sentence-transformers/all-mpnet-base-v2'
 
-def set_model(device: str):
-    from sentence_transformers import SentenceTransformer
+def set_model(device: str,
+              cache_folder: str | None = None,
+              use_embedding_cache: bool = True,
+              cache_size_mb: float = 2048,
+              cache_dtype: str = 'float32',
+              batch_size: int = 32,
+              backend: str = 'torch'):
+    from inference_backends import load_embedding_model, DEFAULT_MODELS_FOLDER
+    from encoding import BucketedEncoder
     global model, embedding_model_name
-    model = SentenceTransformer(embedding_model_name, device=device)
-    debug_print(f"Model loaded successfully on device: {device}")
+    models_folder = join_paths(cache_folder, 'models') if cache_folder is not None else DEFAULT_MODELS_FOLDER
+    model = load_embedding_model(embedding_model_name, backend=backend, device=device, models_folder=models_folder)
+    model = BucketedEncoder(model, batch_size=batch_size)
+    debug_print(f"Model loaded successfully on device: {device} ({backend} backend)")
+
+    if cache_folder is not None and use_embedding_cache:
+        from embedding_cache import EmbeddingCache, CachedEncoder
+        cache = EmbeddingCache(join_paths(cache_folder, 'embeddings'),
+                               f'{embedding_model_name}-{backend}',
+                               dim=model.get_sentence_embedding_dimension(),
+                               dtype=cache_dtype,
+                               max_size_mb=cache_size_mb)
+        model = CachedEncoder(model, cache)
+        debug_print(f"Embedding cache loaded with {len(cache)} vectors.")
 
 # =======================================================================================================================
 
-def main(target: str | list[str], 
-         persist_folder: str,
-         how: str,
-         device: str):
-    
-    valid_countries = ['ARG', 'TUR', 'UKR', 'EGY']
+def prepare_country(client, country: str, incremental: bool, hnsw: dict, max_batch_size: int, presidencies: dict[str, str] | None = None) -> CountryJob:
+    import chromadb.errors
 
-    if isinstance(target, str):
-        target = [target]
+    collection_name = 'imf_publications_'+country.lower()
 
-    for country in target:
-        debug_print(f"Processing country: {country}")
+    if not incremental:
+        try: 
+            client.get_collection(collection_name)
+            client.delete_collection(collection_name)
+        except (ValueError, chromadb.errors.InvalidCollectionException):
+            pass
 
-        if country not in valid_countries:
-            raise ValueError(f"Invalid country name. Expected one of {valid_countries}")
-        
-        debug_print('Loading publications...')
-        publications = load_country_publications(country.upper(), how=how)
-        publications = flatten(publications, 1)
+    collection = client.get_or_create_collection(collection_name, 
+                                                 embedding_function=None, 
+                                                 metadata=hnsw)
 
-        all_docs, metadatas = zip(*((doc.page_content, doc.metadata) for doc in publications))
+    if incremental and any(collection.metadata.get(k) != v for k, v in hnsw.items()):
+        debug_print(f"HNSW parameters of an existing collection can't be changed, keeping {collection.metadata}.")
 
-        debug_print('Vectorizing documents...')
-        embeddings = model.encode(all_docs, show_progress_bar=True, device=device).tolist() # 1.35 it/s @ 1.5 GHz
+    files = list_country_files(country)
+    file_hashes = {f: file_hash(f) for f in files}
+    file_presidencies = {f: presidency_of(f, presidencies or {}) for f in files}
 
-        # ids = [str(get_uuid()) for _ in range(len(embeddings))]
-        ids = map(get_id, all_docs)
-        ids = list(ids)
+    indexed = get_indexed_sources(collection, max_batch_size) if incremental else {}
 
-        client = chromadb.PersistentClient(path=persist_folder)
+    unchanged_files = {f for f, h in file_hashes.items() if f in indexed and indexed[f][0] == {(h, file_presidencies[f])}}
+    files_to_load = [f for f in files if f not in unchanged_files]
 
-        collection_name = 'imf_publications_'+country.lower()
-        try: 
-            client.get_collection(collection_name)
-            client.delete_collection(collection_name)
-        except (ValueError, chromadb.errors.InvalidCollectionException):
-            pass
+    # Los chunks de publicaciones que ya no están en 'docs' se eliminan.
+    stale_ids = {i for source, (_, ids) in indexed.items() if source not in file_hashes for i in ids}
 
-        client.create_collection(collection_name, 
-                                 embedding_function=None, 
-                                 metadata={'hnsw:space': 'cosine'})
-        max_batch_size = client.get_max_batch_size()
+    debug_print(f"{country}: {len(unchanged_files)} unchanged publications, {len(files_to_load)} to load.")
 
-        same_length = len(embeddings) == len(ids) == len(metadatas) == len(all_docs)
-        embeddings_less_than_max_batch_size =  len(embeddings) < max_batch_size
+    return CountryJob(country=country,
+                      collection=collection,
+                      method='upsert' if incremental else 'add',
+                      file_hashes=file_hashes,
+                      indexed=indexed,
+                      files_to_load=files_to_load,
+                      stale_ids=stale_ids,
+                      presidencies=file_presidencies)
 
-        debug_print(f"All lists have same length: {same_length}")
+def print_summary(jobs: list[CountryJob], started_at: float):
+    """
+    Para cada país, cuándo terminó cada etapa (en segundos desde el inicio)
+    y los chunks insertados por segundo de escritura (tiempo de reloj con
+    alguna escritura en curso, no la suma de lo que tardó cada hilo).
+    """
+    print(f"{'country':<8} {'files':>6} {'chunks':>8} {'parsed':>8} {'embedded':>9} {'written':>8} {'insert/s':>9}")
 
-        debug_print(f"Embeddings less than max batch size: {embeddings_less_than_max_batch_size}")
+    for job in jobs:
+        end = lambda stage: f"{job.timings[stage][1] - started_at:.1f}s" if stage in job.timings else '-'
+        insert_rate = f"{job.written / job.write_seconds:.1f}" if job.write_seconds > 0 else '-'
+        print(f"{job.country:<8} {len(job.files_to_load):>6} {job.written:>8} {end('parse'):>8} {end('embed'):>9} {end('write'):>8} {insert_rate:>9}")
 
-        # f = (lambda x: split_list_into_chunks(x, max_batch_size)) if not embeddings_less_than_max_batch_size else (lambda x: x)
+    print(f"Total: {sum(job.written for job in jobs)} chunks in {perf_counter() - started_at:.1f}s.")
 
-        collection = client.get_collection(collection_name)
+def main(target: str | list[str], 
+         persist_folder: str,
+         how: str,
+         device: str,
+         incremental: bool = False,
+         embed_batch_size: int = 512,
+         queue_size: int = 4,
+         cache_folder: str | None = None,
+         no_pdf_cache: bool = False,
+         pdf_backend: str = DEFAULT_PDF_BACKEND,
+         pages_per_shard: int = 32,
+         writers: int = 1,
+         hnsw: dict | None = None,
+         presidencies_file: str | None = DEFAULT_PRESIDENCIES_FILE):
+    """
+    Vectoriza todos los países pedidos en un solo pipeline, con un único
+    cliente de Chroma y el modelo ya cargado: mientras se embeben los chunks
+    de un país ya se están parseando las publicaciones del siguiente.
+    """
+    import chromadb
+
+    hnsw = hnsw or hnsw_metadata()
 
-        if embeddings_less_than_max_batch_size:
-            collection.add(
-                documents  = (list(all_docs)),
-                metadatas  = (list(metadatas)),
-                ids        = (list(ids)),
-                embeddings = (list(embeddings))
-            )
-        else:
-            chunked_documents  = split_list_into_chunks(list(all_docs), max_batch_size)
-            chunked_metadatas  = split_list_into_chunks(list(metadatas), max_batch_size)
-            chunked_ids        = split_list_into_chunks(list(ids), max_batch_size)
-            chunked_embeddings = split_list_into_chunks(list(embeddings), max_batch_size)
+    if isinstance(target, str):
+        target = [target]
+
+    for country in target:
+        if country not in VALID_COUNTRIES:
+            raise ValueError(f"Invalid country name. Expected one of {VALID_COUNTRIES}")
+
+    started_at = perf_counter()
+
+    client = chromadb.PersistentClient(path=persist_folder)
+    max_batch_size = client.get_max_batch_size()
+
+    presidencies = load_presidencies(presidencies_file)
+    jobs = [prepare_country(client, country, incremental, hnsw, max_batch_size, presidencies) for country in target]
+    jobs_by_file = {file: job for job in jobs for file in job.files_to_load}
+    files_to_load = [file for job in jobs for file in job.files_to_load]
+
+    debug_print('Loading and vectorizing publications...')
+    pdf_cache_folder = None if (no_pdf_cache or cache_folder is None) else join_paths(cache_folder, 'pdf')
+    publications = iter_in_thread(iter_publications(files_to_load, 
+                                                    how=how, 
+                                                    cache_folder=pdf_cache_folder,
+                                                    backend=pdf_backend,
+                                                    pages_per_shard=pages_per_shard,
+                                                    file_hashes={f: job.file_hashes[f] for f, job in jobs_by_file.items()}), maxsize=queue_size)
+    chunks = iter_new_chunks(publications, jobs_by_file)
+    batches = iter_in_thread(iter_embedded_batches(chunks, embed_batch_size, device), maxsize=queue_size)
+
+    stream_to_collections(batches, max_batch_size, writers=writers)
+
+    for job in jobs:
+        if job.stale_ids:
+            debug_print(f"{job.country}: deleting {len(job.stale_ids)} stale chunks...")
+            delete_from_collection(job.collection, job.stale_ids, max_batch_size)
+
+        debug_print(f"{job.country}: collection stored successfully. {job.written} embeddings written, it contains {job.collection.count()} embeddings.")
 
-            for i in range(len(chunked_documents)):
-                collection.add(
-                    documents  = chunked_documents[i],
-                    metadatas  = chunked_metadatas[i],
-                    ids        = chunked_ids[i],
-                    embeddings = chunked_embeddings[i]
-                )
+    if hasattr(model, 'cache'):
+        model.save()
+        debug_print(model.stats())
 
-        debug_print(f"Collection stored successfully. It contains {len(embeddings)} embeddings.")
+    print(model.report())
+    print_summary(jobs, started_at)
 
 # =======================================================================================================================
 
 class Parser(argparse.ArgumentParser):
     def __init__(self):
         super(Parser, self).__init__()
-        self.add_argument('-t','--target', type=str, nargs='+', required=True, help='Country code of the publications to vectorize')
+        self.add_argument('-t','--target', type=str.upper, nargs='+', required=True, choices=VALID_COUNTRIES, help='Country code of the publications to vectorize')
         self.add_argument('-p','--persist_folder', type=str, default='./persist', help='Folder to store the embeddings')
         self.add_argument('-m','--mode', type=str, default='multiprocess', help='How to load the publications')
         self.add_argument('-d','--device', type=str, default='auto', help='Device to use for vectorization')
+        self.add_argument('-i','--incremental', action='store_true', help='Only vectorize new or changed publications, keeping the existing collection')
+        self.add_argument('--embed-batch-size', type=int, default=512, help='Number of chunks embedded per step of the pipeline, sorted by length into batches')
+        self.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnx', 'onnx-int8'], help='Inference backend for the embedding model (onnx-int8 is a dynamically quantized CPU graph)')
+        self.add_argument('-b','--batch-size', type=int, default=32, help='Batch size for the embedding model')
+        self.add_argument('--queue-size', type=int, default=4, help='Maximum number of items buffered between pipeline stages')
+        self.add_argument('--cache-folder', type=str, default='./cache', help='Folder for the on-disk caches')
+        self.add_argument('--pdf-backend', type=str, default=DEFAULT_PDF_BACKEND, choices=['auto', *PDF_BACKENDS],
+                          help="Text extractor for the publications ('auto' picks the fastest installed one). "
+                               "Backends other than pypdf extract different text, so they produce different chunks and chunk ids "
+                               "(in incremental mode every indexed chunk gets replaced)")
+        self.add_argument('--pages-per-shard', type=int, default=32, help='Split publications into page ranges of this size across workers (0 to load whole files)')
+        self.add_argument('--no-pdf-cache', action='store_true', help='Always extract the text of the publications, without using the extraction cache')
+        self.add_argument('--no-embedding-cache', action='store_true', help='Always encode chunks with the model, without using the embedding cache')
+        self.add_argument('--embedding-cache-size', type=float, default=2048, help='Maximum size of the embedding cache, in MB')
+        self.add_argument('--embedding-cache-dtype', type=str, default='float32', choices=['float32', 'float16'], help='Precision of the cached embeddings')
+        self.add_argument('--presidencies-file', type=str, default=DEFAULT_PRESIDENCIES_FILE, help="JSON with the publications of each administration, stored as the chunks' 'presidente'")
+        self.add_argument('-w','--writers', type=int, default=1, help='Number of threads writing batches to the collection')
+        self.add_argument('--hnsw-m', type=int, default=None, help="HNSW 'M' (max neighbours per node)")
+        self.add_argument('--hnsw-construction-ef', type=int, default=None, help="HNSW 'ef_construction' (candidate list size while building)")
+        self.add_argument('--hnsw-search-ef', type=int, default=None, help="HNSW 'ef_search' (candidate list size while querying)")
+        self.add_argument('--hnsw-num-threads', type=int, default=None, help='Threads used by HNSW to build the index')
+        self.add_argument('--hnsw-batch-size', type=int, default=None, help='Vectors buffered before they are added to the HNSW index')
+        self.add_argument('--hnsw-sync-threshold', type=int, default=None, help='Vectors added before the HNSW index is persisted to disk')
         self.add_argument('-v','--verbose', action='store_true', help='Prints more information')
 
     def parse_args(self):
         self.args = super(Parser, self).parse_args().__dict__
         self.args['how'] = self.args.pop('mode')
+        self.args['hnsw'] = hnsw_metadata(
+            M               = self.args.pop('hnsw_m'),
+            construction_ef = self.args.pop('hnsw_construction_ef'),
+            search_ef       = self.args.pop('hnsw_search_ef'),
+            num_threads     = self.args.pop('hnsw_num_threads'),
+            batch_size      = self.args.pop('hnsw_batch_size'),
+            sync_threshold  = self.args.pop('hnsw_sync_threshold'))
         return self
 
 
@@ -210,7 +664,14 @@ if __name__ == '__main__':
             case _:
                 raise ValueError("Invalid value for 'device' argument. Expected one of ['auto', 'cpu', 'cuda']")
 
-        set_model(device)
+        cache_folder = parser.args['cache_folder']
+        set_model(device,
+                  cache_folder=cache_folder,
+                  use_embedding_cache=not parser.args.pop('no_embedding_cache'),
+                  cache_size_mb=parser.args.pop('embedding_cache_size'),
+                  cache_dtype=parser.args.pop('embedding_cache_dtype'),
+                  batch_size=parser.args.pop('batch_size'),
+                  backend=parser.args.pop('backend'))
         parser.args['device'] = device
         main(**parser.args)
         sys.exit(0)